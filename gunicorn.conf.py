@@ -0,0 +1,13 @@
+# Read by gunicorn from the directory it is started in
+import os
+
+wsgi_app = "playlistor.wsgi"
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Conversion pages keep an event stream open for as long as the conversion
+# runs (see main.views.conversion_events). With gevent workers each stream
+# holds a greenlet and a Redis connection while it waits, not a whole worker.
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
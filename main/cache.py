@@ -1,21 +1,157 @@
+import logging
+import math
+import random
+import time
+from collections import namedtuple
 from functools import wraps
 
 from django.core.cache import cache
 
+logger = logging.getLogger(__name__)
+
+# How long a caller may hold the right to compute a missing value
+LOCK_TIMEOUT = 30
+
+# How long other callers wait for that value before computing it themselves
+WAIT_TIMEOUT = 10
+WAIT_INTERVAL = 0.1
+
+# Higher values refresh hot keys earlier. 1 is the recommended default, see
+# "Optimal Probabilistic Cache Stampede Prevention" (Vattani et al.)
+EARLY_REFRESH_BETA = 1
+
+# A cached value, how long it took to compute and when it expires
+CacheEntry = namedtuple("CacheEntry", ["value", "delta", "expires_at"])
+
+
+def _unwrap(entry):
+    if isinstance(entry, CacheEntry):
+        return entry.value
+    # Written before entries were wrapped
+    return entry
+
+
+def _should_refresh(entry):
+    """
+    Decide whether to recompute a value ahead of its expiry. The closer the
+    expiry and the slower the value is to compute, the likelier a refresh is,
+    so a hot key is refreshed by one caller before it expires for everyone.
+    """
+    if not isinstance(entry, CacheEntry):
+        return False
+    early = -entry.delta * EARLY_REFRESH_BETA * math.log(1 - random.random())
+    return time.time() + early >= entry.expires_at
+
+
+def wait_for(key):
+    """
+    Wait for a value someone else holds the lock on. Returns the value and
+    False once it is published. If the holder lets go of the lock without
+    publishing it, for instance because it failed, one of the waiters takes
+    the lock over and gets None and True, to compute the value itself. Others
+    keep waiting. None and False if nothing came within WAIT_TIMEOUT.
+    """
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        value = get_cached(key)
+        if value is not None:
+            return value, False
+        if lock(key):
+            # The value may have been published just before the lock was let go
+            value = get_cached(key)
+            if value is not None:
+                unlock(key)
+                return value, False
+            return None, True
+    return None, False
+
+
+def get_cached(key):
+    """Read a value cached by cache_with_key or set_many, None if unavailable"""
+    try:
+        return _unwrap(cache.get(key))
+    except Exception as e:
+        logger.warning(f"Could not read {key} from the cache: {e}")
+        return None
+
+
+def set_many(values, timeout, delta=0):
+    """
+    Cache precomputed values the way cache_with_key does. Values that cannot
+    be cached are only logged, they are still good to use.
+    """
+    expires_at = time.time() + timeout
+    try:
+        cache.set_many(
+            {
+                key: CacheEntry(value, delta, expires_at)
+                for key, value in values.items()
+            },
+            timeout=timeout,
+        )
+    except Exception as e:
+        logger.warning(f"Could not cache {len(values)} value(s): {e}")
+
+
+def lock(key):
+    """
+    Take the right to compute the value for `key` for LOCK_TIMEOUT seconds.
+    False if someone else holds it. Without a working cache everyone may
+    compute, since nobody would see the value published anyway.
+    """
+    try:
+        return cache.add(f"{key}:lock", 1, timeout=LOCK_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Could not lock {key}: {e}")
+        return True
+
+
+def unlock(key):
+    try:
+        cache.delete(f"{key}:lock")
+    except Exception as e:
+        logger.warning(f"Could not unlock {key}: {e}")
+
 
 def cache_with_key(keyfunc, timeout):
+    """
+    Cache the result of the decorated function under `keyfunc(*args, **kwargs)`.
+
+    Concurrent misses on the same key are coalesced: the first caller computes
+    the value while the others, on any worker, wait for it to be published.
+    Values are also refreshed probabilistically shortly before they expire.
+    """
+
     def decorator(func):
         @wraps(func)
         def func_with_caching(*args, **kwargs):
             key = keyfunc(*args, **kwargs)
+            if key is None:
+                return func(*args, **kwargs)
             try:
-                value = cache.get(key)
+                entry = cache.get(key)
             except:
                 return func(*args, **kwargs)
-            if value is not None:
+            value = _unwrap(entry)
+            if value is not None and not _should_refresh(entry):
                 return value
-            value = func(*args, **kwargs)
-            cache.set(key, value, timeout=timeout)
+
+            locked = lock(key)
+            if not locked:
+                # Someone else is computing the value
+                if value is not None:
+                    return value
+                value, locked = wait_for(key)
+                if value is not None:
+                    return value
+            try:
+                start = time.monotonic()
+                value = func(*args, **kwargs)
+                set_many({key: value}, timeout, delta=time.monotonic() - start)
+            finally:
+                if locked:
+                    unlock(key)
             return value
 
         return func_with_caching
@@ -1,8 +1,13 @@
+import asyncio
 import datetime
 import json
+import threading
 
+import httpx
 import jwt
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 BASE_URL = "https://api.music.apple.com"
 
@@ -10,6 +15,33 @@ API_VERSION = "v1"
 
 TIMEOUT_SECONDS = 30
 
+# Maximum number of ISRCs the songs endpoint accepts in one filter
+MAX_ISRCS_PER_REQUEST = 25
+
+# Maximum number of tracks the playlist tracks endpoint returns in one page
+MAX_PLAYLIST_TRACKS_PER_REQUEST = 300
+
+# Times a request is retried after a 429 when a rate limiter is set
+MAX_THROTTLED_RETRIES = 3
+
+# Connections kept alive per host. Should cover the requests a process makes
+# at once, i.e. its gevent concurrency.
+POOL_SIZE = 10
+
+# Times idempotent requests are retried after connection errors or server
+# errors, with exponential backoff
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+
+# How long developer tokens are valid for, and how long before that a
+# replacement is signed
+DEVELOPER_TOKEN_LIFETIME = datetime.timedelta(hours=12)
+DEVELOPER_TOKEN_REFRESH_MARGIN = datetime.timedelta(hours=1)
+
+# Least time left on tokens handed to MusicKit pages, which keep using them
+# for as long as they stay open
+BROWSER_DEVELOPER_TOKEN_MIN_LIFETIME = datetime.timedelta(hours=6)
+
 
 # Track types
 # The possible values are songs, music-videos, library-songs, or library-music-videos.
@@ -20,6 +52,126 @@ TRACK_TYPE_LIBRARY_SONGS = "library-songs"
 TRACK_TYPE_LIBRARY_MUSIC_VIDEOS = "library-music-videos"
 
 
+class DeveloperTokenProvider:
+    """
+    Hands out one signed developer token until it nears expiry.
+
+    A replacement is signed on a background thread once the current token
+    enters its refresh margin, and callers keep getting the current token in
+    the meantime. Only the first caller, or one arriving after the token has
+    expired or needing it to last longer than it will, waits for signing.
+    """
+
+    def __init__(
+        self,
+        team_id,
+        key_id,
+        private_key,
+        lifetime=DEVELOPER_TOKEN_LIFETIME,
+        refresh_margin=DEVELOPER_TOKEN_REFRESH_MARGIN,
+    ):
+        self.team_id = team_id
+        self.key_id = key_id
+        self.private_key = private_key
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _sign(self):
+        # see https://developer.apple.com/documentation/applemusicapi/getting_keys_and_creating_tokens
+        time_now = datetime.datetime.now(datetime.timezone.utc)
+        time_expired = time_now + self.lifetime
+        headers = {"alg": "ES256", "kid": self.key_id}
+        payload = {
+            "iss": self.team_id,
+            "exp": int(time_expired.timestamp()),
+            "iat": int(time_now.timestamp()),
+        }
+        token = jwt.encode(
+            payload, self.private_key, algorithm="ES256", headers=headers
+        )
+        return token, time_expired
+
+    def refresh(self):
+        """Sign a new token now"""
+        token, expires_at = self._sign()
+        with self._lock:
+            self.token, self.expires_at = token, expires_at
+            self._refreshing = False
+        return token
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self, min_lifetime=datetime.timedelta(0)):
+        """A token valid for at least `min_lifetime` more"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            token, expires_at = self.token, self.expires_at
+            usable = token is not None and now + min_lifetime < expires_at
+            stale = not usable or now >= expires_at - self.refresh_margin
+            refresh_in_background = usable and stale and not self._refreshing
+            if refresh_in_background:
+                self._refreshing = True
+        if not usable:
+            return self.refresh()
+        if refresh_in_background:
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return token
+
+
+_token_providers = {}
+_token_providers_lock = threading.Lock()
+
+
+def get_developer_token_provider(team_id, key_id, private_key):
+    """The process-wide DeveloperTokenProvider for a key"""
+    with _token_providers_lock:
+        provider = _token_providers.get((team_id, key_id))
+        if provider is None or provider.private_key != private_key:
+            provider = DeveloperTokenProvider(team_id, key_id, private_key)
+            _token_providers[(team_id, key_id)] = provider
+        return provider
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(
+    pool_size=POOL_SIZE, retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR
+):
+    """
+    The process-wide pooled session for these settings, so connections are
+    kept alive and reused by every client instead of being set up per request
+    """
+    with _sessions_lock:
+        session = _sessions.get((pool_size, retries, backoff_factor))
+        if session is None:
+            session = requests.Session()
+            retry = Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(500, 502, 503, 504),
+            )
+            adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size,
+                max_retries=retry,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[(pool_size, retries, backoff_factor)] = session
+        return session
+
+
 class AppleMusicClient:
     def __init__(
         self,
@@ -30,6 +182,12 @@ class AppleMusicClient:
         base_url=BASE_URL,
         api_version=API_VERSION,
         timeout=TIMEOUT_SECONDS,
+        rate_limiter=None,
+        response_cache=None,
+        pool_size=POOL_SIZE,
+        retries=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        session=None,
     ):
         self.team_id = team_id
         self.key_id = key_id
@@ -38,12 +196,22 @@ class AppleMusicClient:
         self.base_url = base_url
         self.api_version = api_version
         self.timeout = timeout
+        # Optional main.ratelimit.RateLimiter pacing every request
+        self.rate_limiter = rate_limiter
+        # Optional main.response_cache.ResponseCache for catalog requests
+        self.response_cache = response_cache
+        self.session = session or get_session(pool_size, retries, backoff_factor)
         self.headers = self._get_auth_headers()
 
+    @property
+    def token_provider(self):
+        return get_developer_token_provider(self.team_id, self.key_id, self.private_key)
+
+    @property
+    def developer_token(self):
+        return self.token_provider.get()
+
     def _get_auth_headers(self):
-        self.developer_token = self._generate_developer_token(
-            self.team_id, self.key_id, self.private_key
-        )
         headers = {
             "Authorization": "Bearer %s" % self.developer_token,
             "Content-Type": "application/json",
@@ -52,26 +220,13 @@ class AppleMusicClient:
             headers["Music-User-Token"] = self.user_access_token
         return headers
 
-    def _generate_developer_token(self, team_id, key_id, private_key):
-        # see https://developer.apple.com/documentation/applemusicapi/getting_keys_and_creating_tokens
-        time_now = datetime.datetime.now()
-        time_expired = time_now + datetime.timedelta(hours=12)
-        headers = {"alg": "ES256", "kid": key_id}
-        payload = {
-            "iss": team_id,
-            "exp": int(time_expired.strftime("%s")),
-            "iat": int(time_now.strftime("%s")),
-        }
-        token = jwt.encode(payload, private_key, algorithm="ES256", headers=headers)
-        return token
-
     def _request_method(self, method):
         return {
-            "GET": requests.get,
-            "POST": requests.post,
-            "PUT": requests.put,
-            "PATCH": requests.patch,
-            "DELETE": requests.delete,
+            "GET": self.session.get,
+            "POST": self.session.post,
+            "PUT": self.session.put,
+            "PATCH": self.session.patch,
+            "DELETE": self.session.delete,
         }.get(method)
 
     def _make_request(
@@ -83,15 +238,56 @@ class AppleMusicClient:
         payload = payload or {}
         url = "%s%s%s" % (self.base_url, base_path, endpoint)
         request_method = self._request_method(method)
-        response = request_method(
-            url,
-            params=params,
-            headers=self.headers,
-            data=json.dumps(payload),
-            timeout=self.timeout,
-        )
+        # Picks up tokens refreshed since the client was created
+        self.headers["Authorization"] = "Bearer %s" % self.developer_token
+        cached, headers = self._get_cached(method, url, params)
+        if cached is not None and self.response_cache.is_fresh(cached):
+            return cached.body
+        for attempt in range(MAX_THROTTLED_RETRIES + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(url)
+            response = request_method(
+                url,
+                params=params,
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=self.timeout,
+            )
+            if (
+                response.status_code != 429
+                or self.rate_limiter is None
+                or attempt == MAX_THROTTLED_RETRIES
+            ):
+                break
+            self.rate_limiter.throttled(url, response.headers)
+        return self._handle_response(response, method, url, params, cached)
+
+    def _get_cached(self, method, url, params):
+        """
+        The cached response to a request, if any, and the headers to send it
+        with, asking for the resource only if it changed since
+        """
+        if self.response_cache is None or not self.response_cache.cacheable(
+            method, url
+        ):
+            return None, self.headers
+        cached = self.response_cache.get(url, params)
+        return cached, {
+            **self.headers,
+            **self.response_cache.conditional_headers(cached),
+        }
+
+    def _handle_response(self, response, method, url, params, cached):
+        if cached is not None and response.status_code == 304:
+            self.response_cache.revalidated(url, params, cached, response.headers)
+            return cached.body
         response.raise_for_status()
-        return response.content and response.json() or {}
+        body = response.content and response.json() or {}
+        if self.response_cache is not None and self.response_cache.cacheable(
+            method, url
+        ):
+            self.response_cache.set(url, params, body, response.headers)
+        return body
 
     """Helper Functions"""
 
@@ -104,6 +300,7 @@ class AppleMusicClient:
         self.headers["Music-User-Token"] = self.user_access_token = value
 
     def refresh_developer_token(self):
+        self.token_provider.refresh()
         self.headers = self._get_auth_headers()
 
     def next(self, resource, limit=None):
@@ -164,7 +361,13 @@ class AppleMusicClient:
         )
 
     def get_songs_by_isrc(self, isrc, storefront="us", include=None):
-        """https://developer.apple.com/documentation/applemusicapi/get_multiple_catalog_songs_by_isrc"""
+        """https://developer.apple.com/documentation/applemusicapi/get_multiple_catalog_songs_by_isrc
+        Params:
+            `isrc` <str> or <list(<str>, ...)>
+                At most `MAX_ISRCS_PER_REQUEST` ISRCs per request.
+        """
+        if not isinstance(isrc, str):
+            isrc = ",".join(isrc)
         params = {"filter[isrc]": isrc}
         if include:
             params["include"] = include
@@ -183,6 +386,19 @@ class AppleMusicClient:
             params=params,
         )
 
+    def get_playlist_tracks(self, id, storefront="us", limit=None, offset=None):
+        """https://developer.apple.com/documentation/applemusicapi/get_a_catalog_playlist_s_relationship_directly_by_name"""
+        params = {}
+        if limit:
+            params["limit"] = limit
+        if offset:
+            params["offset"] = offset
+        return self._make_request(
+            method="GET",
+            endpoint="/catalog/%s/playlists/%s/tracks" % (storefront, id),
+            params=params,
+        )
+
     def get_playlists(self, ids, storefront="us", include=None):
         """https://developer.apple.com/library/content/documentation/NetworkingInternetWeb/Conceptual/AppleMusicWebServicesReference/GetMultiplePlaylists.html#//apple_ref/doc/uid/TP40017625-CH21-SW1"""
         params = {"ids": ",".join(ids)}
@@ -385,3 +601,123 @@ class AppleMusicClient:
         https://developer.apple.com/documentation/applemusicapi/getting_keys_and_creating_tokens
         """
         return self._make_request(method="GET", endpoint="/test")
+
+
+class AsyncAppleMusicClient(AppleMusicClient):
+    """
+    AppleMusicClient for asyncio. The endpoint methods are the same but
+    return awaitables, so many requests can be in flight on one event loop.
+    Failed requests raise httpx.HTTPStatusError.
+
+    The client owns a pool of keep-alive connections, so close it with
+    `aclose()` or use it as an async context manager.
+    """
+
+    def __init__(
+        self,
+        team_id,
+        key_id,
+        private_key,
+        access_token=None,
+        base_url=BASE_URL,
+        api_version=API_VERSION,
+        timeout=TIMEOUT_SECONDS,
+        rate_limiter=None,
+        response_cache=None,
+        pool_size=POOL_SIZE,
+        retries=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        session=None,
+    ):
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        if session is None:
+            session = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=pool_size, max_keepalive_connections=pool_size
+                ),
+                # Retries connection errors only, server errors are retried
+                # by _make_request
+                transport=httpx.AsyncHTTPTransport(retries=retries),
+                timeout=timeout,
+            )
+        super().__init__(
+            team_id,
+            key_id,
+            private_key,
+            access_token=access_token,
+            base_url=base_url,
+            api_version=api_version,
+            timeout=timeout,
+            rate_limiter=rate_limiter,
+            response_cache=response_cache,
+            session=session,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.session.aclose()
+
+    async def _make_request(
+        self, method, endpoint, base_path=None, params=None, payload=None
+    ):
+        if base_path is None:
+            base_path = "/%s" % self.api_version
+        url = "%s%s%s" % (self.base_url, base_path, endpoint)
+        self.headers["Authorization"] = "Bearer %s" % self.developer_token
+        cached, headers = None, self.headers
+        if self.response_cache is not None:
+            # The cache talks to Redis, off the event loop
+            cached, headers = await asyncio.to_thread(
+                self._get_cached, method, url, params
+            )
+            if cached is not None and self.response_cache.is_fresh(cached):
+                return cached.body
+        throttled = server_errors = 0
+        while True:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(url)
+            response = await self.session.request(
+                method,
+                url,
+                params=params,
+                headers=headers,
+                content=json.dumps(payload) if payload else None,
+                timeout=self.timeout,
+            )
+            if (
+                response.status_code == 429
+                and self.rate_limiter is not None
+                and throttled < MAX_THROTTLED_RETRIES
+            ):
+                throttled += 1
+                await self.rate_limiter.athrottled(url, response.headers)
+            elif (
+                response.status_code in (500, 502, 503, 504)
+                and method != "POST"
+                and server_errors < self.retries
+            ):
+                await asyncio.sleep(self.backoff_factor * 2**server_errors)
+                server_errors += 1
+            else:
+                break
+        if self.response_cache is None:
+            return self._handle_response(response, method, url, params, cached)
+        return await asyncio.to_thread(
+            self._handle_response, response, method, url, params, cached
+        )
+
+    async def search(self, query, *args, **kwargs):
+        if not query:
+            return None
+        return await super().search(query, *args, **kwargs)
+
+    async def next(self, resource, limit=None):
+        if not (resource and resource.get("next")):
+            return None
+        return await super().next(resource, limit=limit)
@@ -15,3 +15,16 @@ class Counters:
 
     def incr_playlist_counter(self, key=PLAYLIST_COUNTER_KEY):
         self.incr(key)
+
+    def incr_many(self, key, amounts):
+        """Increment several fields of the hash at `key` in one round trip"""
+        pipe = self._redis.pipeline()
+        for field, amount in amounts.items():
+            pipe.hincrby(key, field, amount)
+        pipe.execute()
+
+    def get_many(self, key):
+        return {
+            field.decode(): int(value)
+            for field, value in self._redis.hgetall(key).items()
+        }
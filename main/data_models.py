@@ -1,12 +1,17 @@
-from dataclasses import asdict, dataclass
-from typing import List, Optional
+from dataclasses import dataclass, field, fields
+from typing import TYPE_CHECKING, List, Optional
 
+if TYPE_CHECKING:
+    from .matching import MatchProfile
 
-@dataclass
+
+@dataclass(slots=True)
 class Track:
     """
     Unified Track representation for cross-platform compatibility.
     Combines fields from all previous Track implementations.
+
+    Slotted, since conversions hold thousands of them.
     """
 
     id: str
@@ -20,20 +25,30 @@ class Track:
     release_date: Optional[str] = None
     position: Optional[int] = None
 
+    # Normalized view used by the matcher, built on first use. It is left out
+    # of pickles, so cached tracks do not carry it.
+    profile: Optional["MatchProfile"] = field(default=None, repr=False, compare=False)
+
     # Computed properties
     @property
     def length(self) -> Optional[int]:
         """Duration in seconds"""
         return self.duration_ms // 1000 if self.duration_ms else None
 
-    @property
-    def albums(self) -> List[str]:
-        """Return album as list for compatibility with similarity functions"""
-        return [self.album] if self.album else []
-
     def to_dict(self) -> dict:
         """Convert to dictionary, useful for serialization"""
-        return asdict(self)
+        return {
+            f.name: getattr(self, f.name) for f in fields(self) if f.name != "profile"
+        }
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        # Also reads tracks pickled before Track was slotted
+        for f in fields(self):
+            object.__setattr__(self, f.name, state.get(f.name, f.default))
+        self.profile = None
 
 
 @dataclass
@@ -52,6 +67,12 @@ class Playlist:
     artwork_url: Optional[str] = None
     url: Optional[str] = None
 
+    # Number of tracks, when known before all of them are fetched
+    total_tracks: Optional[int] = None
+
+    # Changes whenever the playlist does, see StreamingService.get_playlist_version
+    version: Optional[str] = None
+
     def to_dict(self) -> dict:
         """Convert to dictionary with tracks as dicts"""
         return {
@@ -62,4 +83,6 @@ class Playlist:
             "description": self.description,
             "artwork_url": self.artwork_url,
             "url": self.url,
+            "total_tracks": self.total_tracks,
+            "version": self.version,
         }
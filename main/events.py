@@ -0,0 +1,33 @@
+import json
+import logging
+
+import redis
+from django.utils.functional import cached_property
+
+from .utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class ConversionEvents:
+    """Publishes and subscribes to events of a conversion task over Redis pub/sub"""
+
+    def __init__(self, task_id):
+        self.channel = f"conversion:{task_id}"
+
+    @cached_property
+    def _redis(self):
+        return get_redis_client()
+
+    def publish(self, event, data=None):
+        try:
+            self._redis.publish(
+                self.channel, json.dumps({"event": event, "data": data})
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish {event} event to {self.channel}: {e}")
+
+    def subscribe(self):
+        pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        return pubsub
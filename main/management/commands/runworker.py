@@ -1,16 +1,46 @@
 import shlex
 import subprocess
+from functools import partial
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import autoreload
 
 
-def restart_celery():
-    subprocess.call(shlex.split("pkill celery"))
-    subprocess.call(shlex.split("celery -A playlistor worker -l info -P gevent -c 50"))
+def restart_celery(queues, concurrency=None):
+    # Each queue gets its own worker, so a long conversion only ever takes
+    # capacity from conversions of its own size
+    for queue in queues:
+        subprocess.call(["pkill", "-f", f"celery -A playlistor worker -n {queue}@"])
+    workers = [
+        subprocess.Popen(
+            shlex.split(
+                f"celery -A playlistor worker -n {queue}@%h -Q {queue} -l info "
+                f"-P gevent -c {concurrency or settings.WORKER_CONCURRENCY[queue]}"
+            )
+        )
+        for queue in queues
+    ]
+    for worker in workers:
+        worker.wait()
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queues",
+            default=",".join(settings.WORKER_CONCURRENCY),
+            help="Comma separated queues to consume, each by its own worker",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            help="Concurrency of every worker, instead of WORKER_CONCURRENCY",
+        )
+
     def handle(self, *args, **options):
-        print("Starting celery worker with autoreload")
-        autoreload.run_with_reloader(restart_celery)
+        queues = options["queues"].split(",")
+        print(f"Starting celery workers for {', '.join(queues)} with autoreload")
+        autoreload.run_with_reloader(
+            partial(restart_celery, queues, options["concurrency"])
+        )
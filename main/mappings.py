@@ -0,0 +1,86 @@
+import logging
+
+from django.db import DatabaseError, transaction
+
+from .models import Track
+from .utils import grouper
+
+logger = logging.getLogger(__name__)
+
+# Track model field holding each service's track id
+SERVICE_ID_FIELDS = {
+    "spotify": "spotify_id",
+    "apple-music": "apple_music_id",
+}
+
+# Keeps `IN (...)` clauses well under SQLite's bound parameter limit
+BATCH_SIZE = 500
+
+
+def get_track_mappings(source_service, destination_service, source_tracks):
+    """
+    Look up source tracks that have been matched before.
+
+    Returns a dict mapping source track ids to destination track ids.
+    """
+    source_field = SERVICE_ID_FIELDS[str(source_service)]
+    destination_field = SERVICE_ID_FIELDS[str(destination_service)]
+    source_ids = {track.id for track in source_tracks if track.id}
+
+    mappings = {}
+    for chunk in grouper(BATCH_SIZE, source_ids):
+        mappings.update(
+            Track.objects.filter(
+                **{
+                    f"{source_field}__in": chunk,
+                    f"{destination_field}__isnull": False,
+                }
+            ).values_list(source_field, destination_field)
+        )
+    return mappings
+
+
+def save_track_mappings(source_service, destination_service, matches):
+    """
+    Record newly confirmed matches so later conversions can skip searching.
+
+    `matches` is an iterable of (source_track, destination_track) pairs.
+    """
+    source_field = SERVICE_ID_FIELDS[str(source_service)]
+    destination_field = SERVICE_ID_FIELDS[str(destination_service)]
+
+    tracks = {}
+    for source_track, destination_track in matches:
+        if not source_track.id:
+            # Local files and the like cannot be looked up again
+            continue
+        tracks[source_track.id] = Track(
+            name=(source_track.name or "")[: Track.MAX_LENGTH],
+            artists=", ".join(source_track.artists)[: Track.MAX_LENGTH],
+            isrc=source_track.isrc,
+            **{
+                source_field: source_track.id,
+                destination_field: destination_track.id,
+            },
+        )
+    # Both ids are unique, so only one source track may claim a destination
+    # track, and one that is already mapped is left alone.
+    tracks = {getattr(track, destination_field): track for track in tracks.values()}
+    for chunk in grouper(BATCH_SIZE, list(tracks)):
+        for destination_id in Track.objects.filter(
+            **{f"{destination_field}__in": chunk}
+        ).values_list(destination_field, flat=True):
+            del tracks[destination_id]
+    if not tracks:
+        return
+
+    try:
+        with transaction.atomic():
+            Track.objects.bulk_update_or_create(
+                list(tracks.values()),
+                [destination_field, "name", "artists", "isrc"],
+                match_field=source_field,
+                batch_size=BATCH_SIZE,
+            )
+    except DatabaseError as e:
+        logger.warning(f"Could not save {len(tracks)} track mapping(s): {e}")
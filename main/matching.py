@@ -1,6 +1,57 @@
 # Adapted from https://github.com/platers/unitunes/blob/master/unitunes/matcher.py
+import functools
+from collections import namedtuple
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
 from strsimpy.jaro_winkler import JaroWinkler
 
+from .utils import parse_track_name
+
+SPECIAL_TERMS = (
+    "instrumental",
+    "remix",
+    "cover",
+    "live",
+    "version",
+    "edit",
+    "nightcore",
+)
+
+# Feature weights
+WEIGHTS = {
+    "name": 50,
+    "album": 20,
+    "artists": 30,
+    "length": 20,
+}
+
+# Minimum similarity for two tracks to be considered the same
+MATCH_THRESHOLD = 0.7
+
+# Number of string pairs whose similarity is remembered per process
+SIMILARITY_CACHE_SIZE = 2**16
+
+# JaroWinkler holds no per-comparison state, so a single instance is shared.
+_jaro_winkler = JaroWinkler()
+
+# A string lowercased once, along with the special terms it contains.
+_Alias = namedtuple("_Alias", ["text", "terms"])
+
+
+@dataclass(frozen=True, slots=True)
+class MatchProfile:
+    """
+    Compact, normalized view of a Track holding only what the similarity
+    features need. The text fields are tuples of aliases, any of which may
+    match, and `length` is the duration in seconds, if known.
+    """
+
+    name: Tuple[_Alias, ...]
+    artists: Tuple[_Alias, ...]
+    album: Tuple[_Alias, ...]
+    length: Optional[int]
+
 
 def pairwise_max(a, b, f):
     """Find maximum similarity score between elements of two lists"""
@@ -8,86 +59,176 @@ def pairwise_max(a, b, f):
     for i in a:
         for j in b:
             mx = max(mx, f(i, j))
+            if mx >= 1:
+                # Nothing can beat a perfect score
+                return mx
     return mx
 
 
+def _alias(s):
+    text = s.lower()
+    return _Alias(text, frozenset(term for term in SPECIAL_TERMS if term in text))
+
+
+def _aliases(strings):
+    return tuple(_alias(s) for s in strings if s)
+
+
+@functools.lru_cache(maxsize=SIMILARITY_CACHE_SIZE)
+def _text_similarity(text1, text2):
+    # Never yields, so it is safe to share between gevent greenlets.
+    return _jaro_winkler.similarity(text1, text2)
+
+
+def _alias_similarity(a1, a2):
+    # Any keyword present in one string but not the other is a mismatch.
+    if a1.terms != a2.terms:
+        return 0
+    # Jaro-Winkler is symmetric, so order the pair to share memo entries.
+    if a1.text > a2.text:
+        a1, a2 = a2, a1
+    return _text_similarity(a1.text, a2.text)
+
+
+def similarity_cache_info():
+    """Hit and miss counters of the string similarity memo"""
+    return _text_similarity.cache_info()
+
+
+def _vetoed(aliases1, aliases2):
+    """True if every pair differs in special terms, i.e. the feature scores 0"""
+    return all(a1.terms != a2.terms for a1 in aliases1 for a2 in aliases2)
+
+
 def normalized_string_similarity(s1, s2):
     """Returns a similarity score between 0 and 1. Penalizes differences in keywords like 'instrumental'"""
-    special_terms = [
-        "instrumental",
-        "remix",
-        "cover",
-        "live",
-        "version",
-        "edit",
-        "nightcore",
-    ]
-    for term in special_terms:
-        in_s1 = term in s1.lower()
-        in_s2 = term in s2.lower()
-        if in_s1 ^ in_s2:
-            return 0
-    return JaroWinkler().similarity(s1.lower(), s2.lower())
+    return _alias_similarity(_alias(s1), _alias(s2))
 
 
 def aliased_string_similarity(s1, s2):
     return pairwise_max(s1, s2, normalized_string_similarity)
 
 
-def track_similarity(track1, track2):
+def length_similarity(length_sec_1, length_sec_2):
+    d = abs(length_sec_1 - length_sec_2)
+    max_dist = 5
+    if d > max_dist:
+        return 0
+    return 1 - d / max_dist
+
+
+def build_profile(track):
+    """Normalize `track` into a MatchProfile"""
+    parsed = parse_track_name(track.name) if track.name else None
+    names = [track.name]
+    artists = list(track.artists or [])
+    if parsed:
+        # Platforms disagree on whether featured artists belong in the title
+        # or in the artist list, so both forms are kept.
+        names.append(parsed["track_name"])
+        artists.extend(parsed["featured_artists"])
+    return MatchProfile(
+        name=_aliases(dict.fromkeys(names)),
+        artists=_aliases(dict.fromkeys(artists)),
+        album=_aliases([track.album]),
+        length=track.length,
+    )
 
-    def artists_similarity(artists1, artists2):
-        if len(artists1) == 0 or len(artists2) == 0:
-            return 0.5
-        return pairwise_max(artists1, artists2, aliased_string_similarity)
 
-    def album_similarity(album1, album2):
-        return pairwise_max(album1, album2, aliased_string_similarity)
+def _profile(track):
+    """The profile of `track`, built once and kept on the track"""
+    if track.profile is None:
+        track.profile = build_profile(track)
+    return track.profile
 
-    def length_similarity(length_sec_1, length_sec_2):
-        d = abs(length_sec_1 - length_sec_2)
-        max_dist = 5
-        if d > max_dist:
-            return 0
-        return 1 - d / max_dist
 
-    # Feature weights
-    weights = {
-        "name": 50,
-        "album": 20,
-        "artists": 30,
-        "length": 20,
-    }
+def _similarity(profile1, profile2, floor=None, ceiling=None):
+    """
+    Weighted similarity of two tracks.
 
-    feature_scores = {}
+    Cheap features (length and the special-term veto) are settled first, then
+    the string features in decreasing order of weight. When `floor` is given,
+    scoring stops once the remaining features cannot lift the score to it and
+    an upper bound below `floor` is returned. When `ceiling` is given, scoring
+    stops once the score reaches it and a lower bound is returned. Either way
+    the bound is on the same side of `floor` or `ceiling` as the exact score.
+    """
+    weighted_sum = 0
+    total_weight = 0
 
     # Compute feature scores only if both tracks have the feature
-    if track1.name and track2.name:
-        feature_scores["name"] = aliased_string_similarity(track1.name, track2.name)
-
-    if track1.artists and track2.artists:
-        feature_scores["artists"] = artists_similarity(track1.artists, track2.artists)
-
-    if track1.albums and track2.albums:
-        feature_scores["album"] = album_similarity(track1.albums, track2.albums)
-
-    if track1.length and track2.length:
-        feature_scores["length"] = length_similarity(track1.length, track2.length)
-
-    used_features = feature_scores.keys()
-    if not used_features:
+    if profile1.length and profile2.length:
+        weighted_sum += WEIGHTS["length"] * length_similarity(
+            profile1.length, profile2.length
+        )
+        total_weight += WEIGHTS["length"]
+
+    pending = []
+    for feature in ("name", "artists", "album"):
+        aliases1 = getattr(profile1, feature)
+        aliases2 = getattr(profile2, feature)
+        if aliases1 and aliases2:
+            total_weight += WEIGHTS[feature]
+            if not _vetoed(aliases1, aliases2):
+                pending.append((WEIGHTS[feature], aliases1, aliases2))
+
+    if not total_weight:
         return 0.0
 
-    # Calculate weighted average
-    weighted_sum = sum(
-        feature_scores[feature] * weights[feature] for feature in used_features
-    )
-    total_weight = sum(weights[feature] for feature in used_features)
+    remaining_weight = sum(weight for weight, _, _ in pending)
+    for weight, aliases1, aliases2 in pending:
+        if floor is not None and weighted_sum + remaining_weight < floor * total_weight:
+            return (weighted_sum + remaining_weight) / total_weight
+        if ceiling is not None and weighted_sum >= ceiling * total_weight:
+            return weighted_sum / total_weight
+        weighted_sum += weight * pairwise_max(aliases1, aliases2, _alias_similarity)
+        remaining_weight -= weight
+
     similarity = weighted_sum / total_weight
 
     assert 0 <= similarity <= 1
     return similarity
 
 
-def are_tracks_same(track1, track2, threshold=0.7):
-    return track_similarity(track1, track2) >= threshold
+def score_tracks(track, candidates):
+    """
+    Score every candidate against `track` in a single pass.
+
+    Each track is normalized exactly once, however many comparisons it takes
+    part in. Returns the scores in the same order as `candidates`.
+    """
+    profile = _profile(track)
+    return [_similarity(profile, _profile(candidate)) for candidate in candidates]
+
+
+def best_match(track, candidates, threshold=MATCH_THRESHOLD):
+    """
+    Return the highest scoring candidate reaching `threshold` and its score.
+
+    Candidates that cannot beat both `threshold` and the best score so far are
+    abandoned early. If none reaches `threshold`, returns None and an upper
+    bound of the best score.
+    """
+    profile = _profile(track)
+    best, best_score = None, 0.0
+    for candidate in candidates:
+        floor = max(threshold, best_score)
+        score = _similarity(profile, _profile(candidate), floor=floor)
+        if score > best_score:
+            best_score = score
+            if score >= threshold:
+                best = candidate
+            if best_score >= 1:
+                break
+    return best, best_score
+
+
+def track_similarity(track1, track2):
+    return score_tracks(track1, [track2])[0]
+
+
+def are_tracks_same(track1, track2, threshold=MATCH_THRESHOLD):
+    score = _similarity(
+        _profile(track1), _profile(track2), floor=threshold, ceiling=threshold
+    )
+    return score >= threshold
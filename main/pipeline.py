@@ -0,0 +1,57 @@
+import queue
+import threading
+
+# Items buffered between two pipeline stages, at most. Bounds memory however
+# long the playlist and makes a fast stage wait for a slow one.
+PIPELINE_BUFFER_SIZE = 4
+
+# How often, in seconds, a blocked stage checks whether it should give up
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(iterable, size=PIPELINE_BUFFER_SIZE):
+    """
+    Iterate over `iterable` on a background thread, staying at most `size`
+    items ahead of the consumer. Errors are raised in the consumer.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as e:
+            put(_Failure(e))
+        else:
+            put(_DONE)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        # Let the producer go if the consumer stopped early
+        stopped.set()
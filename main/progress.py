@@ -0,0 +1,123 @@
+import time
+from types import SimpleNamespace
+
+from celery_progress.backend import ProgressRecorder
+from django.utils.functional import cached_property
+
+from .events import ConversionEvents
+from .utils import get_redis_client
+
+# Long enough to outlive any conversion
+PROGRESS_KEY_TIMEOUT = 3600 * 6
+
+# Progress is written at most once per interval (seconds) unless it has
+# moved by at least the step (percent) since the last write
+PROGRESS_INTERVAL = 1
+PROGRESS_STEP = 5
+
+
+class _ParentTask:
+    """Stand-in task whose state updates land on another task's id"""
+
+    def __init__(self, task, task_id):
+        self.task = task
+        self.request = SimpleNamespace(id=task_id)
+
+    def update_state(self, state=None, meta=None):
+        self.task.update_state(task_id=self.request.id, state=state, meta=meta)
+
+
+class ThrottledProgressRecorder(ProgressRecorder):
+    """
+    Progress recorder that merges frequent updates, writing to the result
+    backend only when enough time has passed or progress has moved enough
+    since the last write. The first state is always written, and the last
+    one once `flush()` is called after matching.
+
+    Each write is also published, along with the tracks decided since the
+    previous one, to the task's ConversionEvents channel.
+    """
+
+    def __init__(self, task, interval=PROGRESS_INTERVAL, step=PROGRESS_STEP):
+        super().__init__(task)
+        self.interval = interval
+        self.step = step
+        self.flushed_at = None
+        self.flushed_percent = None
+        self.events = ConversionEvents(task.request.id)
+        self.decided_tracks = []
+        # Last progress set but not written yet
+        self.pending = None
+
+    def record_track(self, source_track, matched):
+        """Queue a decided track to be published with the next write"""
+        self.decided_tracks.append(
+            {
+                "name": source_track.name,
+                "artists": source_track.artists,
+                "matched": matched,
+            }
+        )
+
+    def _should_flush(self, current, total):
+        percent = 100 * current / total if total else 100
+        if (
+            self.flushed_at is not None
+            and current < total
+            and time.monotonic() - self.flushed_at < self.interval
+            and percent - self.flushed_percent < self.step
+        ):
+            return False
+        self.flushed_at = time.monotonic()
+        self.flushed_percent = percent
+        return True
+
+    def _flush(self, current, total, description):
+        state, meta = super().set_progress(current, total, description)
+        self.events.publish(
+            "progress", {"progress": meta, "tracks": self.decided_tracks}
+        )
+        self.decided_tracks = []
+        return state, meta
+
+    def set_progress(self, current, total, description=""):
+        if self._should_flush(current, total):
+            self.pending = None
+            return self._flush(current, total, description)
+        self.pending = (current, total, description)
+
+    def flush(self):
+        """Write the last progress set, if it was held back"""
+        if self.pending is not None:
+            current, total, description = self.pending
+            self.pending = None
+            self.flushed_at = time.monotonic()
+            self.flushed_percent = 100 * current / total if total else 100
+            return self._flush(current, total, description)
+
+
+class ChunkProgressRecorder(ThrottledProgressRecorder):
+    """
+    Progress recorder for one chunk of a conversion split across subtasks.
+
+    Tracks processed by every chunk are summed in Redis and reported as the
+    progress of the parent task, which is the task the frontend polls.
+    """
+
+    def __init__(self, task, parent_task_id, total):
+        super().__init__(_ParentTask(task, parent_task_id))
+        self.key = f"progress:{parent_task_id}"
+        self.parent_total = total
+        self.chunk_current = 0
+
+    @cached_property
+    def _redis(self):
+        return get_redis_client()
+
+    def _flush(self, current, total, description):
+        pipe = self._redis.pipeline()
+        pipe.incrby(self.key, current - self.chunk_current)
+        pipe.expire(self.key, PROGRESS_KEY_TIMEOUT)
+        processed, _ = pipe.execute()
+        self.chunk_current = current
+        return super()._flush(processed, self.parent_total, description)
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import re
+import time
+from urllib.parse import urlsplit
+
+import redis
+import requests
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from .client import MAX_THROTTLED_RETRIES
+from .utils import get_redis_client, requests_retry_session
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_KEY = "ratelimit:{upstream}:{endpoint}"
+
+# Buckets idle for this long are forgotten and start over at the full rate
+BUCKET_TIMEOUT = 3600
+
+# Share of the rate kept after a 429, and how fast, in requests per second
+# per second, it climbs back towards the configured rate afterwards
+DECREASE_FACTOR = 0.5
+RECOVERY_RATE = 0.1
+
+# The rate never drops below this, in requests per second
+MIN_RATE = 0.5
+
+# Wait this long, in seconds, after a 429 that does not carry a Retry-After
+DEFAULT_RETRY_AFTER = 1
+
+# Returns the seconds to wait before a request may be sent, having taken a
+# token if that is 0. Between requests the bucket refills at the current rate
+# and the rate recovers towards `max_rate`.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local recovery_rate = tonumber(ARGV[4])
+local state = redis.call("HMGET", KEYS[1], "tokens", "rate", "updated_at", "blocked_until")
+local tokens = tonumber(state[1]) or burst
+local rate = tonumber(state[2]) or max_rate
+local updated_at = tonumber(state[3]) or now
+local blocked_until = tonumber(state[4]) or 0
+if now < blocked_until then
+    return tostring(blocked_until - now)
+end
+local elapsed = math.max(0, now - updated_at)
+rate = math.min(max_rate, rate + elapsed * recovery_rate)
+tokens = math.min(burst, tokens + elapsed * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "rate", rate, "updated_at", now)
+redis.call("EXPIRE", KEYS[1], ARGV[5])
+return tostring(wait)
+"""
+
+# Cuts the rate and empties the bucket, pausing it for `retry_after` seconds
+THROTTLE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_rate = tonumber(ARGV[2])
+local rate = tonumber(redis.call("HGET", KEYS[1], "rate")) or max_rate
+rate = math.max(tonumber(ARGV[4]), rate * tonumber(ARGV[3]))
+redis.call(
+    "HSET", KEYS[1],
+    "tokens", 0, "rate", rate, "updated_at", now,
+    "blocked_until", now + tonumber(ARGV[5])
+)
+redis.call("EXPIRE", KEYS[1], ARGV[6])
+return tostring(rate)
+"""
+
+
+def endpoint_class(url):
+    """
+    Coarse kind of endpoint a request is for, e.g. search or playlists, each
+    of which gets its own bucket.
+    """
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+    if parts and re.fullmatch(r"v\d+", parts[0]):
+        parts = parts[1:]
+    if parts[:1] == ["catalog"]:
+        # Skip the storefront
+        parts = parts[2:]
+    return parts[0] if parts else ""
+
+
+def retry_after_seconds(headers):
+    try:
+        return max(0, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class RateLimiter:
+    """
+    Token buckets in Redis, shared by every worker, that pace requests to an
+    upstream API.
+
+    Each endpoint class has its own bucket, refilled at up to the upstream's
+    rate in settings.UPSTREAM_RATE_LIMITS. A 429 halves the rate and pauses
+    the bucket for the response's Retry-After, after which the rate climbs
+    back slowly, so it settles just under the actual quota.
+    """
+
+    def __init__(self, upstream, rate=None, burst=None):
+        self.upstream = upstream
+        self.rate = rate or settings.UPSTREAM_RATE_LIMITS[upstream]
+        self.burst = burst or self.rate
+
+    @cached_property
+    def _redis(self):
+        return get_redis_client()
+
+    @cached_property
+    def _acquire(self):
+        return self._redis.register_script(ACQUIRE_SCRIPT)
+
+    @cached_property
+    def _throttle(self):
+        return self._redis.register_script(THROTTLE_SCRIPT)
+
+    def _key(self, url):
+        return RATE_LIMIT_KEY.format(
+            upstream=self.upstream, endpoint=endpoint_class(url)
+        )
+
+    def _wait(self, url):
+        """Seconds to wait before a request to `url` may be sent, 0 if it may now"""
+        try:
+            return float(
+                self._acquire(
+                    keys=[self._key(url)],
+                    args=[
+                        time.time(),
+                        self.rate,
+                        self.burst,
+                        RECOVERY_RATE,
+                        BUCKET_TIMEOUT,
+                    ],
+                )
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Could not rate limit {self.upstream} request: {e}")
+            return 0
+
+    def _slow_down(self, url, retry_after):
+        """Cut the rate of `url`'s bucket, False if Redis could not be reached"""
+        try:
+            rate = self._throttle(
+                keys=[self._key(url)],
+                args=[
+                    time.time(),
+                    self.rate,
+                    DECREASE_FACTOR,
+                    MIN_RATE,
+                    retry_after,
+                    BUCKET_TIMEOUT,
+                ],
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Could not throttle {self.upstream} requests: {e}")
+            return False
+        logger.info(
+            f"Throttled by {self.upstream}, pausing {endpoint_class(url)} requests "
+            f"for {retry_after}s and lowering the rate to {float(rate):.2f}/s"
+        )
+        return True
+
+    def acquire(self, url):
+        """Block until a request to `url` may be sent"""
+        while (wait := self._wait(url)) > 0:
+            time.sleep(wait)
+
+    def throttled(self, url, headers=None):
+        """Slow down requests like the one to `url` that got a 429"""
+        retry_after = retry_after_seconds(headers or {})
+        if not self._slow_down(url, retry_after):
+            time.sleep(retry_after)
+
+    # Only the Redis calls of the coroutines below run in a thread, waits are
+    # on the event loop, so waiting requests do not tie up the thread pool
+
+    async def aacquire(self, url):
+        """Wait until a request to `url` may be sent, without blocking the loop"""
+        while (wait := await asyncio.to_thread(self._wait, url)) > 0:
+            await asyncio.sleep(wait)
+
+    async def athrottled(self, url, headers=None):
+        """Like throttled, without blocking the event loop"""
+        retry_after = retry_after_seconds(headers or {})
+        if not await asyncio.to_thread(self._slow_down, url, retry_after):
+            await asyncio.sleep(retry_after)
+
+
+class RateLimitedSession(requests.Session):
+    """
+    Session pacing its requests with a RateLimiter and retrying the ones that
+    get a 429 once the limiter allows. Server errors are retried with backoff.
+    """
+
+    def __init__(self, rate_limiter, retries=3, backoff_factor=1):
+        super().__init__()
+        self.rate_limiter = rate_limiter
+        requests_retry_session(
+            retries=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            session=self,
+        )
+
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(MAX_THROTTLED_RETRIES + 1):
+            self.rate_limiter.acquire(url)
+            response = super().request(method, url, *args, **kwargs)
+            if response.status_code != 429 or attempt == MAX_THROTTLED_RETRIES:
+                return response
+            self.rate_limiter.throttled(url, response.headers)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import time
+from collections import namedtuple
+from urllib.parse import urlencode, urlsplit
+
+import redis
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from .ratelimit import endpoint_class
+from .utils import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_KEY = "http:{upstream}:{digest}"
+
+# How long responses that can be revalidated are kept after they go stale
+VALIDATED_TIMEOUT = 3600 * 24 * 30
+
+# A cached response body, its validators and until when it is used as is
+CachedResponse = namedtuple(
+    "CachedResponse", ["body", "etag", "last_modified", "fresh_until"]
+)
+
+
+class ResponseCache:
+    """
+    Catalog GET responses of an upstream API, kept in Redis by URL and
+    parameters and shared by every worker.
+
+    A response is used as is for its endpoint class's timeout. After that,
+    one that came with an ETag or Last-Modified is revalidated with a
+    conditional request, so an unchanged resource costs a 304. Others are
+    fetched again. Requests for a user's library are never cached.
+    """
+
+    def __init__(self, upstream, timeouts, default_timeout=0):
+        self.upstream = upstream
+        self.timeouts = timeouts
+        self.default_timeout = default_timeout
+
+    @cached_property
+    def _redis(self):
+        return get_redis_client()
+
+    def _key(self, url, params):
+        query = urlencode(sorted((params or {}).items()), doseq=True)
+        digest = hashlib.sha1(f"{url}?{query}".encode()).hexdigest()
+        return RESPONSE_CACHE_KEY.format(upstream=self.upstream, digest=digest)
+
+    def _timeout(self, url):
+        return self.timeouts.get(endpoint_class(url), self.default_timeout)
+
+    def cacheable(self, method, url):
+        return method == "GET" and "/catalog/" in urlsplit(url).path
+
+    def is_fresh(self, cached):
+        return time.time() < cached.fresh_until
+
+    def get(self, url, params):
+        try:
+            cached = self._redis.get(self._key(url, params))
+        except redis.RedisError as e:
+            logger.warning(f"Could not read cached {self.upstream} response: {e}")
+            return None
+        if cached is None:
+            return None
+        return CachedResponse(**json.loads(cached))
+
+    def conditional_headers(self, cached):
+        """Headers asking for `cached`'s resource only if it changed"""
+        headers = {}
+        if cached is None:
+            return headers
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        return headers
+
+    def set(self, url, params, body, headers):
+        """Cache the body of a successful response with `headers`"""
+        if "no-store" in headers.get("Cache-Control", ""):
+            return
+        self._store(
+            url,
+            params,
+            CachedResponse(
+                body=body,
+                etag=headers.get("ETag"),
+                last_modified=headers.get("Last-Modified"),
+                fresh_until=time.time() + self._timeout(url),
+            ),
+        )
+
+    def revalidated(self, url, params, cached, headers):
+        """Keep using `cached` after a 304 with `headers`"""
+        self._store(
+            url,
+            params,
+            cached._replace(
+                etag=headers.get("ETag") or cached.etag,
+                last_modified=headers.get("Last-Modified") or cached.last_modified,
+                fresh_until=time.time() + self._timeout(url),
+            ),
+        )
+
+    def _store(self, url, params, cached):
+        timeout = self._timeout(url)
+        if cached.etag or cached.last_modified:
+            timeout += VALIDATED_TIMEOUT
+        if timeout <= 0:
+            return
+        try:
+            self._redis.set(
+                self._key(url, params), json.dumps(cached._asdict()), ex=timeout
+            )
+        except redis.RedisError as e:
+            logger.warning(f"Could not cache {self.upstream} response: {e}")
+
+
+def get_response_cache(upstream):
+    """The upstream's ResponseCache, or None unless enabled in the settings"""
+    timeouts = settings.RESPONSE_CACHE_TIMEOUTS.get(upstream)
+    if not settings.RESPONSE_CACHE_ENABLED or timeouts is None:
+        return None
+    return ResponseCache(upstream, timeouts)
@@ -0,0 +1,69 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .services import SpotifyService
+from .utils import APPLE_MUSIC_PLAYLIST_URL_PAT, SPOTIFY_PLAYLIST_URL_PAT, strip_qs
+
+logger = logging.getLogger(__name__)
+
+
+def playlist_size_cache_key(service, playlist_id):
+    return f"{service}:playlist:{playlist_id}:size"
+
+
+def save_playlist_size(service, playlist_id, size):
+    """Remember the size of a fetched playlist for routing later conversions"""
+    try:
+        cache.set(
+            playlist_size_cache_key(service, playlist_id),
+            size,
+            timeout=settings.PLAYLIST_SIZE_CACHE_TIMEOUT,
+        )
+    except Exception as e:
+        logger.warning(f"Could not save size of {service} playlist {playlist_id}: {e}")
+
+
+def get_playlist_size(service, playlist_id, peek=None):
+    """
+    Number of tracks in a playlist, as seen by an earlier conversion or as
+    returned by `peek()`, a cheap lookup that does not fetch the tracks.
+    None if unknown.
+    """
+    try:
+        size = cache.get(playlist_size_cache_key(service, playlist_id))
+        if size is None and peek is not None:
+            size = peek()
+            save_playlist_size(service, playlist_id, size)
+        return size
+    except Exception as e:
+        logger.warning(f"Could not get size of {service} playlist {playlist_id}: {e}")
+        return None
+
+
+def queue_for_size(size):
+    if size is None:
+        return settings.CELERY_TASK_DEFAULT_QUEUE
+    if size <= settings.SMALL_PLAYLIST_MAX_TRACKS:
+        return "small"
+    if size >= settings.LARGE_PLAYLIST_MIN_TRACKS:
+        return "large"
+    return "medium"
+
+
+def conversion_queue(platform, url):
+    """Queue for converting the playlist at `url` to `platform`"""
+    url = strip_qs(url)
+    if platform == "apple-music":
+        playlist_id = SPOTIFY_PLAYLIST_URL_PAT.match(url).group("playlist_id")
+        size = get_playlist_size(
+            "spotify",
+            playlist_id,
+            peek=lambda: SpotifyService().get_playlist_size(playlist_id),
+        )
+    else:
+        # Apple Music cannot count tracks without listing them
+        playlist_id = APPLE_MUSIC_PLAYLIST_URL_PAT.match(url).group("playlist_id")
+        size = get_playlist_size("apple-music", playlist_id)
+    return queue_for_size(size)
@@ -1,23 +1,71 @@
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Optional
-from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
 
+import httpx
+import requests
+
+from .client import BASE_URL, MAX_ISRCS_PER_REQUEST, MAX_PLAYLIST_TRACKS_PER_REQUEST
 from .data_models import Playlist, Track
+from .ratelimit import RateLimitedSession, RateLimiter
+from .response_cache import get_response_cache
 from .utils import (
-    generate_auth_token,
     get_applemusic_client,
+    get_async_applemusic_client,
     get_spotify_client,
     grouper,
-    requests_retry_session,
 )
 
+# Playlist pages fetched at once
+PLAYLIST_PAGE_CONCURRENCY = 4
+
+# Only what raw_to_track reads is requested from Spotify
+SPOTIFY_TRACK_FIELDS = (
+    "track(id,name,artists(name),album(name,release_date),duration_ms,"
+    "external_ids(isrc))"
+)
+SPOTIFY_PLAYLIST_ITEMS_FIELDS = f"items({SPOTIFY_TRACK_FIELDS})"
+SPOTIFY_PLAYLIST_FIELDS = (
+    "name,description,owner(display_name),external_urls(spotify),snapshot_id,"
+    f"tracks(total,items({SPOTIFY_TRACK_FIELDS}))"
+)
+SPOTIFY_PLAYLIST_PAGE_SIZE = 100
+
 
 class StreamingService(ABC):
     """Base class for streaming service implementations"""
 
-    @abstractmethod
+    # Number of ISRCs search_tracks_by_isrcs can resolve in one request
+    isrc_batch_size = 1
+
+    # Catalog storefront searches run against, if the service has them
+    storefront = None
+
     def get_playlist(self, playlist_id: str, storefront: str = None) -> Playlist:
         """Fetch playlist data and return as unified Playlist object"""
+        playlist, pages = self.iter_playlist(playlist_id, storefront=storefront)
+        playlist.tracks = [track for page in pages for track in page]
+        return playlist
+
+    @abstractmethod
+    def iter_playlist(
+        self, playlist_id: str, storefront: str = None
+    ) -> Tuple[Playlist, Iterator[List[Track]]]:
+        """
+        Fetch playlist data without its tracks. Returns the Playlist and an
+        iterator over pages of its tracks, fetched as they are consumed.
+        """
+
+    def get_playlist_version(
+        self, playlist_id: str, storefront: str = None
+    ) -> Optional[str]:
+        """
+        Cheaply look up a value that changes whenever the playlist does, if
+        the service has one, to tell whether a fetched copy is still current
+        """
+        return None
 
     @abstractmethod
     def search_track(
@@ -31,35 +79,91 @@ class StreamingService(ABC):
     ) -> List[Track]:
         """Search for a track by isrc"""
 
+    def search_tracks_by_isrcs(
+        self, isrcs: Iterable[str], storefront: str = None
+    ) -> Dict[str, List[Track]]:
+        """Search for many isrcs at once, returning the tracks found per isrc"""
+        return {
+            isrc: self.search_track_by_isrc(isrc, storefront=storefront)
+            for isrc in isrcs
+        }
+
     @abstractmethod
     def create_playlist(
         self, name: str, description: str = None, track_ids: List[str] = None
     ) -> str:
         """Create a new playlist and return its ID"""
 
+    @abstractmethod
+    def add_tracks(self, playlist_id: str, track_ids: List[str]) -> None:
+        """Append tracks to a playlist created by create_playlist"""
+
+
+class AppleMusicResources:
+    """
+    What AppleMusicService and AsyncAppleMusicService share: reading Apple
+    Music resources, and planning the requests for playlist pages and for
+    batches of ISRCs and tracks, which the services then send their own way
+    """
+
+    isrc_batch_size = MAX_ISRCS_PER_REQUEST
+
+    storefront = "us"
+
+    # Tracks a playlist is created with, and then added in each request
+    playlist_write_size = 100
+
+    def page_offset_rounds(self, track_results: dict) -> Iterator[List[int]]:
+        """
+        Offsets of the playlist pages after `track_results`, the first one,
+        in rounds to fetch at once. Nothing if there are no more pages.
+
+        Later pages are fetched, as large as they come, several at a time by
+        offset, since their number is not known up front. They start where
+        the next link says, or else right after the first page.
+        """
+        next_url = track_results.get("next")
+        if next_url is None:
+            return
+        params = dict(parse_qsl(urlsplit(next_url).query))
+        offset = int(params.get("offset", len(track_results["data"])))
+        page_size = MAX_PLAYLIST_TRACKS_PER_REQUEST
+        while True:
+            offsets = [offset + i * page_size for i in range(PLAYLIST_PAGE_CONCURRENCY)]
+            yield offsets
+            offset = offsets[-1] + page_size
+
+    def page_to_tracks(self, data: Optional[dict]) -> List[Track]:
+        """Tracks of a playlist page, none if it was past the last page"""
+        return [self.raw_to_track(raw) for raw in (data or {}).get("data", [])]
+
+    def is_last_page(self, data: Optional[dict]) -> bool:
+        return not (data and data.get("data") and data.get("next"))
+
+    def search_results_to_tracks(self, results: Optional[dict]) -> List[Track]:
+        if not results or "results" not in results or "songs" not in results["results"]:
+            return []
 
-class AppleMusicService(StreamingService):
-    """Apple Music streaming service implementation"""
-
-    def __init__(self, access_token: Optional[str] = None):
-        self.client = get_applemusic_client()
-        if access_token:
-            self.client.access_token = access_token
-
-    def get_playlist(self, playlist_id: str, storefront: str = "us") -> Playlist:
-        """Fetch Apple Music playlist data"""
-        session = requests_retry_session()
-        auth_token = generate_auth_token()
-        headers = {"Authorization": f"Bearer {auth_token}"}
-        API_BASE_URL = "https://api.music.apple.com"
+        return [
+            self.raw_to_track(raw)
+            for raw in results["results"]["songs"].get("data", [])
+        ]
 
-        response = session.get(
-            f"{API_BASE_URL}/v1/catalog/{storefront}/playlists/{playlist_id}",
-            headers=headers,
-        )
-        response.raise_for_status()
-        playlist_data = response.json()["data"][0]
-        playlist_attrs = playlist_data["attributes"]
+    def tracks_by_isrc(
+        self, isrcs: Iterable[str], batches: Iterable[dict]
+    ) -> Dict[str, List[Track]]:
+        """Group the songs found for batches of `isrcs` by ISRC"""
+        tracks = {isrc: [] for isrc in isrcs}
+        for results in batches:
+            for raw in results.get("data", []):
+                track = self.raw_to_track(raw)
+                if track.isrc:
+                    tracks.setdefault(track.isrc.upper(), []).append(track)
+        return tracks
+
+    def raw_to_playlist(self, playlist_id: str, raw: dict) -> Playlist:
+        """Playlist from a catalog playlist resource, without its tracks"""
+        playlist_attrs = raw["attributes"]
 
         # Get artwork URL
         artwork_url = None
@@ -71,70 +175,17 @@ class AppleMusicService(StreamingService):
                     artwork["url"].replace("{w}", str(w)).replace("{h}", str(h))
                 )
 
-        # Get tracks with pagination
-        tracks = []
-        track_items = []
-        track_items.extend(playlist_data["relationships"]["tracks"]["data"])
-        next_url = playlist_data["relationships"]["tracks"].get("next")
-
-        while next_url is not None:
-            response = session.get(urljoin(API_BASE_URL, next_url), headers=headers)
-            data = response.json()
-            track_items.extend(data["data"])
-            next_url = data.get("next")
-        tracks = [self.raw_to_track(raw) for raw in track_items]
-
         return Playlist(
             id=playlist_id,
             name=playlist_attrs["name"],
-            tracks=tracks,
+            tracks=[],
             creator=playlist_attrs.get("curatorName"),
             description=playlist_attrs.get("description", {}).get("short"),
             artwork_url=artwork_url,
             url=playlist_attrs.get("url"),
+            version=playlist_attrs.get("lastModifiedDate"),
         )
 
-    def search_track(
-        self, query: str, limit: int = 10, storefront: str = "us"
-    ) -> List[Track]:
-        results = self.client.search(query=query, limit=limit, storefront=storefront)
-
-        if not results or "results" not in results or "songs" not in results["results"]:
-            return []
-
-        return [
-            self.raw_to_track(raw)
-            for raw in results["results"]["songs"].get("data", [])
-        ]
-
-    def search_track_by_isrc(
-        self, isrc: str, limit: int = 10, storefront: str = "us"
-    ) -> List[Track]:
-        results = self.client.get_songs_by_isrc([isrc], storefront=storefront)
-        return [self.raw_to_track(raw) for raw in results.get("data", [])]
-
-    def create_playlist(
-        self, name: str, description: str = None, track_ids: List[str] = None
-    ) -> str:
-        if len(track_ids) > 100:
-            # Create playlist with first 100 tracks
-            playlist_data = self.client.user_playlist_create(
-                name=name, description=description, track_ids=track_ids[:100]
-            )
-            playlist_id = playlist_data["data"][0]["id"]
-
-            # Add remaining tracks in chunks
-            remaining_tracks = track_ids[100:]
-            for chunk in grouper(100, remaining_tracks):
-                self.client.user_playlist_add_tracks(playlist_id, chunk)
-
-            return playlist_id
-        else:
-            playlist_data = self.client.user_playlist_create(
-                name=name, description=description, track_ids=track_ids
-            )
-            return playlist_data["data"][0]["id"]
-
     def raw_to_track(self, raw: dict) -> Track:
         attrs = raw["attributes"]
         artists = []
@@ -161,39 +212,176 @@ class AppleMusicService(StreamingService):
         return "apple-music"
 
 
+class AppleMusicService(AppleMusicResources, StreamingService):
+    """Apple Music streaming service implementation"""
+
+    def __init__(self, access_token: Optional[str] = None):
+        self.client = get_applemusic_client(
+            rate_limiter=RateLimiter(str(self)),
+            response_cache=get_response_cache(str(self)),
+        )
+        if access_token:
+            self.client.access_token = access_token
+
+    def iter_playlist(
+        self, playlist_id: str, storefront: str = None
+    ) -> Tuple[Playlist, Iterator[List[Track]]]:
+        """Fetch Apple Music playlist data"""
+        storefront = storefront or self.storefront
+        response = self.client.get_playlist(playlist_id, storefront=storefront)
+        playlist_data = response["data"][0]
+        playlist = self.raw_to_playlist(playlist_id, playlist_data)
+        pages = self._iter_playlist_pages(
+            playlist_id, storefront, playlist_data["relationships"]["tracks"]
+        )
+        return playlist, pages
+
+    def _iter_playlist_pages(self, playlist_id, storefront, track_results):
+        # The first page comes with the playlist
+        yield self.page_to_tracks(track_results)
+
+        def fetch_page(offset):
+            try:
+                return self.client.get_playlist_tracks(
+                    playlist_id,
+                    storefront=storefront,
+                    limit=MAX_PLAYLIST_TRACKS_PER_REQUEST,
+                    offset=offset,
+                )
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    # Past the last page
+                    return None
+                raise
+
+        with ThreadPoolExecutor(max_workers=PLAYLIST_PAGE_CONCURRENCY) as executor:
+            for offsets in self.page_offset_rounds(track_results):
+                for data in executor.map(fetch_page, offsets):
+                    tracks = self.page_to_tracks(data)
+                    if tracks:
+                        yield tracks
+                    if self.is_last_page(data):
+                        return
+
+    def get_playlist_version(
+        self, playlist_id: str, storefront: str = None
+    ) -> Optional[str]:
+        # There is no metadata-only request, so this also carries the first
+        # page of tracks, which is still one request instead of all of them
+        playlist = self.client.get_playlist(
+            playlist_id, storefront=storefront or self.storefront
+        )
+        return playlist["data"][0]["attributes"].get("lastModifiedDate")
+
+    def search_track(
+        self, query: str, limit: int = 10, storefront: str = "us"
+    ) -> List[Track]:
+        results = self.client.search(query=query, limit=limit, storefront=storefront)
+        return self.search_results_to_tracks(results)
+
+    def search_track_by_isrc(
+        self, isrc: str, limit: int = 10, storefront: str = "us"
+    ) -> List[Track]:
+        results = self.client.get_songs_by_isrc([isrc], storefront=storefront)
+        return [self.raw_to_track(raw) for raw in results.get("data", [])]
+
+    def search_tracks_by_isrcs(
+        self, isrcs: Iterable[str], storefront: str = "us"
+    ) -> Dict[str, List[Track]]:
+        isrcs = list(isrcs)
+        return self.tracks_by_isrc(
+            isrcs,
+            (
+                self.client.get_songs_by_isrc(chunk, storefront=storefront)
+                for chunk in grouper(self.isrc_batch_size, isrcs)
+            ),
+        )
+
+    def create_playlist(
+        self, name: str, description: str = None, track_ids: List[str] = None
+    ) -> str:
+        track_ids = track_ids or []
+        # Create playlist with the first tracks
+        playlist_data = self.client.user_playlist_create(
+            name=name,
+            description=description,
+            track_ids=track_ids[: self.playlist_write_size],
+        )
+        playlist_id = playlist_data["data"][0]["id"]
+
+        # Add remaining tracks in chunks
+        self.add_tracks(playlist_id, track_ids[self.playlist_write_size :])
+        return playlist_id
+
+    def add_tracks(self, playlist_id: str, track_ids: List[str]) -> None:
+        for chunk in grouper(self.playlist_write_size, track_ids):
+            self.client.user_playlist_add_tracks(playlist_id, chunk)
+
+
 class SpotifyService(StreamingService):
 
     def __init__(self):
-        self.client = get_spotify_client()
+        self.client = get_spotify_client(
+            requests_session=RateLimitedSession(RateLimiter(str(self)))
+        )
 
-    def get_playlist(self, playlist_id: str, storefront: str = None) -> Playlist:
-        playlist = self.client.playlist(playlist_id=playlist_id)
+    def iter_playlist(
+        self, playlist_id: str, storefront: str = None
+    ) -> Tuple[Playlist, Iterator[List[Track]]]:
+        playlist = self.client.playlist(
+            playlist_id=playlist_id, fields=SPOTIFY_PLAYLIST_FIELDS
+        )
+        return (
+            Playlist(
+                id=playlist_id,
+                name=playlist["name"],
+                tracks=[],
+                creator=playlist["owner"]["display_name"],
+                description=playlist["description"],
+                url=playlist["external_urls"]["spotify"],
+                total_tracks=playlist["tracks"]["total"],
+                version=playlist["snapshot_id"],
+            ),
+            self._iter_playlist_pages(playlist_id, playlist["tracks"]),
+        )
 
-        # Get all tracks with pagination
-        tracks = []
-        items = []
-        items.extend(playlist["tracks"]["items"])
-        track_results = playlist["tracks"]
-        has_next = track_results.get("next")
+    def _iter_playlist_pages(self, playlist_id, track_results):
+        # The first page comes with the playlist
+        yield self._page_to_tracks(track_results)
+
+        # Later pages are fetched several at a time by offset
+        def fetch_page(offset):
+            return self.client.playlist_items(
+                playlist_id,
+                fields=SPOTIFY_PLAYLIST_ITEMS_FIELDS,
+                limit=SPOTIFY_PLAYLIST_PAGE_SIZE,
+                offset=offset,
+                additional_types=("track",),
+            )
 
-        while has_next is not None:
-            track_results = self.client.next(track_results)
-            items.extend(track_results["items"])
-            has_next = track_results.get("next")
+        offsets = range(
+            len(track_results["items"]),
+            track_results["total"],
+            SPOTIFY_PLAYLIST_PAGE_SIZE,
+        )
+        with ThreadPoolExecutor(max_workers=PLAYLIST_PAGE_CONCURRENCY) as executor:
+            for wave in grouper(PLAYLIST_PAGE_CONCURRENCY, offsets):
+                for page in executor.map(fetch_page, wave):
+                    yield self._page_to_tracks(page)
 
-        for i, item in enumerate(items):
-            track = item["track"]
-            if track is not None:
-                tracks.append(self.raw_to_track(track))
+    def _page_to_tracks(self, page):
+        return [
+            self.raw_to_track(item["track"])
+            for item in page["items"]
+            if item["track"] is not None
+        ]
 
-        return Playlist(
-            id=playlist_id,
-            name=playlist["name"],
-            tracks=tracks,
-            creator=playlist["owner"]["display_name"],
-            description=playlist["description"],
-            url=playlist["external_urls"]["spotify"],
-        )
+    def get_playlist_version(self, playlist_id: str, storefront: str = None) -> str:
+        return self.client.playlist(playlist_id, fields="snapshot_id")["snapshot_id"]
+
+    def get_playlist_size(self, playlist_id: str, storefront: str = None) -> int:
+        playlist = self.client.playlist(playlist_id, fields="tracks.total")
+        return playlist["tracks"]["total"]
 
     def search_track(
         self, query: str, limit: int = 10, storefront: str = None
@@ -220,17 +408,17 @@ class SpotifyService(StreamingService):
         playlist_id = playlist["id"]
 
         if track_ids:
-            track_uris = [f"spotify:track:{track_id}" for track_id in track_ids]
-
-            # Add tracks in chunks of 100 (Spotify's limit)
-            if len(track_uris) > 100:
-                for chunk in grouper(100, track_uris):
-                    self.client.playlist_add_items(playlist_id, chunk)
-            else:
-                self.client.playlist_add_items(playlist_id, track_uris)
+            self.add_tracks(playlist_id, track_ids)
 
         return playlist_id
 
+    def add_tracks(self, playlist_id: str, track_ids: List[str]) -> None:
+        track_uris = [f"spotify:track:{track_id}" for track_id in track_ids]
+
+        # Add tracks in chunks of 100 (Spotify's limit)
+        for chunk in grouper(100, track_uris):
+            self.client.playlist_add_items(playlist_id, chunk)
+
     def raw_to_track(self, raw: dict) -> Track:
         return Track(
             id=raw["id"],
@@ -244,3 +432,149 @@ class SpotifyService(StreamingService):
 
     def __str__(self):
         return "spotify"
+
+
+class AsyncStreamingService(ABC):
+    """
+    Base class for asyncio streaming service implementations, the
+    counterpart of StreamingService for conversions running many searches
+    at once on one event loop
+    """
+
+    isrc_batch_size = 1
+
+    storefront = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        """Release the service's connections"""
+
+    @abstractmethod
+    async def get_playlist(self, playlist_id: str, storefront: str = None) -> Playlist:
+        """Fetch playlist data and return as unified Playlist object"""
+
+    @abstractmethod
+    async def search_track(
+        self, query: str, limit: int = 10, storefront: str = None
+    ) -> List[Track]:
+        """Search for a track and return matching results"""
+
+    @abstractmethod
+    async def search_track_by_isrc(
+        self, isrc: str, limit: int = 10, storefront: str = None
+    ) -> List[Track]:
+        """Search for a track by isrc"""
+
+    async def search_tracks_by_isrcs(
+        self, isrcs: Iterable[str], storefront: str = None
+    ) -> Dict[str, List[Track]]:
+        """Search for many isrcs at once, returning the tracks found per isrc"""
+        isrcs = list(isrcs)
+        results = await asyncio.gather(
+            *(self.search_track_by_isrc(isrc, storefront=storefront) for isrc in isrcs)
+        )
+        return dict(zip(isrcs, results))
+
+    @abstractmethod
+    async def create_playlist(
+        self, name: str, description: str = None, track_ids: List[str] = None
+    ) -> str:
+        """Create a new playlist and return its ID"""
+
+
+class AsyncAppleMusicService(AppleMusicResources, AsyncStreamingService):
+    """
+    Apple Music streaming service implementation for asyncio. `base_url`
+    points it at another server, e.g. a stub in tests.
+    """
+
+    def __init__(self, access_token: Optional[str] = None, base_url: str = BASE_URL):
+        self.client = get_async_applemusic_client(
+            base_url=base_url,
+            rate_limiter=RateLimiter(str(self)),
+            response_cache=get_response_cache(str(self)),
+        )
+        if access_token:
+            self.client.access_token = access_token
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+    async def get_playlist(self, playlist_id: str, storefront: str = None) -> Playlist:
+        storefront = storefront or self.storefront
+        response = await self.client.get_playlist(playlist_id, storefront=storefront)
+        playlist_data = response["data"][0]
+        playlist = self.raw_to_playlist(playlist_id, playlist_data)
+        track_results = playlist_data["relationships"]["tracks"]
+        playlist.tracks = self.page_to_tracks(track_results)
+
+        async def fetch_page(offset):
+            try:
+                return await self.client.get_playlist_tracks(
+                    playlist_id,
+                    storefront=storefront,
+                    limit=MAX_PLAYLIST_TRACKS_PER_REQUEST,
+                    offset=offset,
+                )
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code == 404:
+                    # Past the last page
+                    return None
+                raise
+
+        for offsets in self.page_offset_rounds(track_results):
+            for data in await asyncio.gather(*map(fetch_page, offsets)):
+                playlist.tracks.extend(self.page_to_tracks(data))
+                if self.is_last_page(data):
+                    return playlist
+        return playlist
+
+    async def search_track(
+        self, query: str, limit: int = 10, storefront: str = "us"
+    ) -> List[Track]:
+        results = await self.client.search(
+            query=query, limit=limit, storefront=storefront
+        )
+        return self.search_results_to_tracks(results)
+
+    async def search_track_by_isrc(
+        self, isrc: str, limit: int = 10, storefront: str = "us"
+    ) -> List[Track]:
+        results = await self.client.get_songs_by_isrc([isrc], storefront=storefront)
+        return [self.raw_to_track(raw) for raw in results.get("data", [])]
+
+    async def search_tracks_by_isrcs(
+        self, isrcs: Iterable[str], storefront: str = "us"
+    ) -> Dict[str, List[Track]]:
+        isrcs = list(isrcs)
+        batches = await asyncio.gather(
+            *(
+                self.client.get_songs_by_isrc(chunk, storefront=storefront)
+                for chunk in grouper(self.isrc_batch_size, isrcs)
+            )
+        )
+        return self.tracks_by_isrc(isrcs, batches)
+
+    async def create_playlist(
+        self, name: str, description: str = None, track_ids: List[str] = None
+    ) -> str:
+        track_ids = track_ids or []
+        # Create playlist with the first tracks
+        playlist_data = await self.client.user_playlist_create(
+            name=name,
+            description=description,
+            track_ids=track_ids[: self.playlist_write_size],
+        )
+        playlist_id = playlist_data["data"][0]["id"]
+
+        # Add remaining tracks in chunks, in order
+        for chunk in grouper(
+            self.playlist_write_size, track_ids[self.playlist_write_size :]
+        ):
+            await self.client.user_playlist_add_tracks(playlist_id, chunk)
+        return playlist_id
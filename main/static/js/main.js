@@ -139,7 +139,8 @@ function onRetry(progressBarElement, progressBarMessageElement, excMessage, retr
 function onProgress(
     progressBarElement,
     progressBarMessageElement,
-    progress
+    progress,
+    tracks
   ) {
     $("#matched-tracks-info")?.remove()
     progressBarMessageElement.innerHTML = ''
@@ -147,7 +148,53 @@ function onProgress(
     progressBarElement.style.width = progress.percent + "%";
     progressBarMessageElement.innerHTML =
       progress.current + " of " + progress.total + " songs processed.";
+
+    const lastTrack = tracks && tracks[tracks.length - 1];
+    if (lastTrack) {
+      const trackInfo = document.createElement('span')
+      trackInfo.setAttribute('id', 'matched-tracks-info')
+      trackInfo.style.fontSize = '0.9em'
+      trackInfo.style.fontStyle = 'italic'
+      trackInfo.textContent = `${lastTrack.matched ? 'Matched' : 'Missed'}: ${lastTrack.name} - ${lastTrack.artists.join(', ')}`
+      progressBarElement.appendChild(trackInfo)
+    }
+  }
+
+function trackProgress(task_id) {
+  const progressBarElement = $("#progress-bar")
+  const progressBarMessageElement = $("#progress-bar-message")
+  const pollProgress = () => {
+    const progressUrl = `/celery-progress/${task_id}/`;
+    CeleryProgressBar.initProgressBar(progressUrl, {onProgress, onError, onSuccess, onTaskError, onRetry});
+  }
+  if (!window.EventSource) {
+    pollProgress();
+    return;
   }
+  // Stream progress, falling back to polling if the stream breaks.
+  const source = new EventSource(`/events/${task_id}`);
+  source.addEventListener('progress', (event) => {
+    const { progress, tracks } = JSON.parse(event.data);
+    onProgress(progressBarElement, progressBarMessageElement, progress, tracks);
+  });
+  source.addEventListener('result', (event) => {
+    source.close();
+    const data = JSON.parse(event.data);
+    if (data.success) {
+      onSuccess(progressBarElement, progressBarMessageElement, data.result);
+    } else {
+      onTaskError(progressBarElement, progressBarMessageElement, data.result);
+    }
+  });
+  source.addEventListener('timeout', () => {
+    source.close();
+    pollProgress();
+  });
+  source.onerror = () => {
+    source.close();
+    pollProgress();
+  };
+}
 
 async function onTaskError(progressBarElement, progressBarMessageElement, excMessage) {
         progressBarElement.style.backgroundColor = "#dc4f63";
@@ -325,8 +372,7 @@ button.onclick = async function(event) {
     });
     raiseForStatus(response);
     const { task_id } = await response.json();
-    const progressUrl = `/celery-progress/${task_id}/`;
-    CeleryProgressBar.initProgressBar(progressUrl, {onProgress, onError, onSuccess, onTaskError, onRetry});
+    trackProgress(task_id);
   } catch (error) {
     const progressBarElement = $("#progress-bar")
     const progressBarMessageElement = $("#progress-bar-message")
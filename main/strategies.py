@@ -0,0 +1,108 @@
+import collections
+import logging
+import random
+import threading
+
+import redis
+
+from .counters import Counters
+from .matching import SPECIAL_TERMS
+
+logger = logging.getLogger(__name__)
+
+STRATEGY_COUNTER_KEY = "counter:strategies:{source}:{destination}:{bucket}"
+
+# A strategy is only judged once it has been tried this many times for a
+# kind of track
+MIN_TRIES = 100
+
+# Strategies that find a match less often than this are skipped
+MIN_HIT_RATE = 0.02
+
+# Share of tracks searched with every strategy in the default order, so
+# skipped strategies keep being measured
+EXPLORE_RATE = 0.05
+
+
+def track_bucket(track):
+    """Cheap features of `track` that set apart how easy it is to find"""
+    name = (track.name or "").lower()
+    has_isrc = int(bool(track.isrc))
+    is_variant = int(any(term in name for term in SPECIAL_TERMS))
+    return f"isrc:{has_isrc}:variant:{is_variant}"
+
+
+class StrategyStats:
+    """
+    Hit and miss counts of search strategies for one conversion direction,
+    bucketed by kind of track.
+
+    Counts are read from Redis once per bucket and written back in one go by
+    `save()`, so they cost no round trips while searching.
+    """
+
+    def __init__(self, source_service, destination_service):
+        self.source = str(source_service)
+        self.destination = str(destination_service)
+        self.counters = Counters()
+        self._stats = {}
+        self._pending = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+
+    def _key(self, bucket):
+        return STRATEGY_COUNTER_KEY.format(
+            source=self.source, destination=self.destination, bucket=bucket
+        )
+
+    def _get(self, bucket):
+        if bucket not in self._stats:
+            try:
+                self._stats[bucket] = self.counters.get_many(self._key(bucket))
+            except redis.RedisError as e:
+                logger.warning(f"Could not read search strategy stats: {e}")
+                self._stats[bucket] = {}
+        return self._stats[bucket]
+
+    def order(self, track, strategies):
+        """
+        Sort `strategies`, (name, func) pairs in default order, by how often
+        each found a match for tracks like `track`, dropping the ones that
+        rarely do. Ties keep the default order.
+        """
+        if random.random() < EXPLORE_RATE:
+            return list(strategies)
+        stats = self._get(track_bucket(track))
+
+        def hit_rate(name):
+            tries = stats.get(f"{name}:tries", 0)
+            hits = stats.get(f"{name}:hits", 0)
+            # Smoothed so untried strategies start out at even odds
+            return tries, (hits + 1) / (tries + 2)
+
+        rated = [(strategy, *hit_rate(strategy[0])) for strategy in strategies]
+        kept = [
+            (strategy, rate)
+            for strategy, tries, rate in rated
+            if tries < MIN_TRIES or rate >= MIN_HIT_RATE
+        ]
+        if not kept:
+            return list(strategies)
+        return [strategy for strategy, _ in sorted(kept, key=lambda kept: -kept[1])]
+
+    def record(self, track, strategy_name, hit):
+        with self._lock:
+            pending = self._pending[track_bucket(track)]
+            pending[f"{strategy_name}:tries"] += 1
+            if hit:
+                pending[f"{strategy_name}:hits"] += 1
+
+    def save(self):
+        with self._lock:
+            pending, self._pending = self._pending, collections.defaultdict(
+                collections.Counter
+            )
+        try:
+            for bucket, amounts in pending.items():
+                self.counters.incr_many(self._key(bucket), amounts)
+        except redis.RedisError as e:
+            logger.warning(f"Could not save search strategy stats: {e}")
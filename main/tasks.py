@@ -1,23 +1,38 @@
+import collections
+import hashlib
 import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import replace
 
 import requests
-from celery import shared_task
+from celery import chord, group, shared_task, states
+from celery.signals import task_postrun
 from celery.utils.log import get_task_logger
-from celery_progress.backend import ProgressRecorder
+from django.conf import settings
+from django.core.cache import cache
 
-from main.cache import cache_with_key
+from main.cache import cache_with_key, get_cached, lock, set_many, unlock, wait_for
 from main.models import Playlist
 from playlistor.celery import app  # noqa
 
 from .counters import Counters
-from .matching import are_tracks_same, track_similarity
+from .data_models import Track
+from .events import ConversionEvents
+from .mappings import get_track_mappings, save_track_mappings
+from .matching import best_match, similarity_cache_info
+from .pipeline import prefetch
+from .progress import ChunkProgressRecorder, ThrottledProgressRecorder
+from .routing import get_playlist_size, save_playlist_size
 from .services import AppleMusicService, SpotifyService
-from .utils import parse_track_name, strip_qs
+from .strategies import StrategyStats
+from .utils import canonical_query, grouper, parse_track_name, strip_qs
 
 logger = get_task_logger(__name__)
 
 counters = Counters()
 
+PLAYLIST_DESCRIPTION = "Made with Playlistor (https://playlistor.io) :)"
+
 SPOTIFY_PLAYLIST_URL_PAT = re.compile(
     r"http(s)?:\/\/open.spotify.com/(user\/.+\/)?playlist/(?P<playlist_id>[^\s?]+)"
 )
@@ -26,72 +41,172 @@ APPLE_MUSIC_PLAYLIST_URL_PAT = re.compile(
 )
 
 
+def playlist_cache_key(service, playlist_id, storefront=None):
+    return f"{service}:{storefront}:playlist:{playlist_id}"
+
+
+@cache_with_key(playlist_cache_key, timeout=settings.PLAYLIST_CACHE_TIMEOUT)
+def get_playlist(service, playlist_id, storefront=None):
+    return service.get_playlist(playlist_id, storefront=storefront)
+
+
+def get_cached_playlist(service, playlist_id, storefront=None):
+    """
+    Return the cached copy of a playlist if the service reports the playlist
+    unchanged since it was fetched, dropping it otherwise.
+    """
+    key = playlist_cache_key(service, playlist_id, storefront)
+    playlist = get_cached(key)
+    if playlist is None:
+        return None
+    try:
+        version = service.get_playlist_version(playlist_id, storefront=storefront)
+    except Exception as e:
+        logger.warning(f"Could not check version of playlist {playlist_id}: {e}")
+        version = None
+    if version is not None and version == playlist.version:
+        return playlist
+    cache.delete(key)
+    return None
+
+
+def cache_playlist(service, playlist, storefront=None):
+    set_many(
+        {playlist_cache_key(service, playlist.id, storefront): playlist},
+        settings.PLAYLIST_CACHE_TIMEOUT,
+    )
+
+
+def cache_pages(service, playlist, pages, storefront=None, locked=False):
+    """
+    Pass pages of a playlist's tracks through, caching the playlist once all
+    of them went by. Playlists too long for one worker are not kept, so memory
+    stays bounded; their next conversion fetches them whole. If `locked`, the
+    lock on the playlist's cache key is released once done.
+    """
+    try:
+        tracks = []
+        for page in pages:
+            if tracks is not None:
+                tracks.extend(page)
+                if len(tracks) > settings.CONVERSION_CHUNK_SIZE:
+                    tracks = None
+            yield page
+        if tracks is not None:
+            cache_playlist(
+                service,
+                replace(playlist, tracks=tracks, total_tracks=len(tracks)),
+                storefront,
+            )
+    finally:
+        if locked:
+            unlock(playlist_cache_key(service, playlist.id, storefront))
+
+
 def search_isrc_cache_key(service, track):
     if track.isrc is not None:
-        return f"{service}:search:isrc:{track.isrc}"
+        return f"{service}:{service.storefront}:search:isrc:{track.isrc.upper()}"
+
+
+def search_query_cache_key(strategy, query_func):
+    """Cache key function for a strategy searching with `query_func(track)`"""
+
+    def keyfunc(service, track):
+        query = query_func(track)
+        if query:
+            digest = hashlib.md5(canonical_query(query).encode()).hexdigest()
+            return f"{service}:{service.storefront}:search:{strategy}:{digest}"
+
+    return keyfunc
+
+
+def full_metadata_query(track):
+    clean_name = parse_track_name(track.name)["track_name"]
+    return f"track:{clean_name} artist:{track.artists}"
+
+
+def primary_artist_query(track):
+    clean_name = parse_track_name(track.name)["track_name"]
+    if track.artists:
+        return f"{clean_name} {track.artists[0]}"
+    return clean_name
 
 
-@cache_with_key(search_isrc_cache_key, timeout=3600 * 24 * 15)
+def fuzzy_name_query(track):
+    return parse_track_name(track.name)["track_name"]
+
+
+@cache_with_key(search_isrc_cache_key, timeout=settings.SEARCH_CACHE_TIMEOUTS["isrc"])
 def search_with_isrc(service, track):
     if track.isrc:
         return service.search_track_by_isrc(track.isrc, limit=10)
     return []
 
 
+@cache_with_key(
+    search_query_cache_key("full_metadata", full_metadata_query),
+    timeout=settings.SEARCH_CACHE_TIMEOUTS["full_metadata"],
+)
 def search_with_full_metadata(service, track):
-    clean_name = parse_track_name(track.name)["track_name"]
-    return service.search_track(f"track:{clean_name} artist:{track.artists}", limit=10)
+    return service.search_track(full_metadata_query(track), limit=10)
 
 
+@cache_with_key(
+    search_query_cache_key("primary_artist", primary_artist_query),
+    timeout=settings.SEARCH_CACHE_TIMEOUTS["primary_artist"],
+)
 def search_with_primary_artist(service, track):
-    clean_name = parse_track_name(track.name)["track_name"]
-    if track.artists:
-        return service.search_track(f"{clean_name} {track.artists[0]}", limit=10)
-    return service.search_track(clean_name, limit=10)
+    return service.search_track(primary_artist_query(track), limit=10)
 
 
+@cache_with_key(
+    search_query_cache_key("fuzzy_name", fuzzy_name_query),
+    timeout=settings.SEARCH_CACHE_TIMEOUTS["fuzzy_name"],
+)
 def search_with_fuzzy_name(service, track):
-    clean_name = parse_track_name(track.name)["track_name"]
-    return service.search_track(clean_name, limit=20)
+    return service.search_track(fuzzy_name_query(track), limit=20)
 
 
 def find_best_match(source_track, search_results):
     if not search_results:
-        return None
+        return None, 0.0
+    return best_match(source_track, search_results)
 
-    matches = sorted(
-        search_results,
-        key=lambda result_track: track_similarity(source_track, result_track),
-        reverse=True,
-    )
-    return matches[0] if matches else None
 
+SEARCH_STRATEGIES = [
+    ("ISRC", search_with_isrc),
+    ("Full metadata", search_with_full_metadata),
+    ("Primary artist", search_with_primary_artist),
+    ("Fuzzy name", search_with_fuzzy_name),
+]
 
-def search_with_quality_fallbacks(service, source_track):
-    search_strategies = [
-        ("ISRC", search_with_isrc),
-        ("Full metadata", search_with_full_metadata),
-        ("Primary artist", search_with_primary_artist),
-        ("Fuzzy name", search_with_fuzzy_name),
-    ]
+
+def search_with_quality_fallbacks(service, source_track, strategy_stats=None):
+    """
+    Try search strategies until one finds a good enough match. Strategies are
+    tried in the order of SEARCH_STRATEGIES, or by observed hit rate when
+    `strategy_stats` is given.
+    """
+    search_strategies = SEARCH_STRATEGIES
+    if strategy_stats is not None:
+        search_strategies = strategy_stats.order(source_track, SEARCH_STRATEGIES)
 
     for strategy_name, strategy_func in search_strategies:
         results = strategy_func(service, source_track)
-        if not results:
-            continue
-
-        best_match = find_best_match(source_track, results)
+        match, similarity = find_best_match(source_track, results or [])
+        found = match is not None
+        if strategy_stats is not None:
+            strategy_stats.record(source_track, strategy_name, found)
 
-        if best_match and are_tracks_same(source_track, best_match):
+        if found:
             logger.info(
                 f"Found good match using {strategy_name} strategy for '{source_track.name}'"
             )
-            return best_match
+            return match
 
-        if best_match:
-            similarity = track_similarity(source_track, best_match)
+        if results:
             logger.info(
-                f"{strategy_name} strategy: best similarity {similarity:.3f} (below threshold) for '{source_track.name}'"
+                f"{strategy_name} strategy: best similarity at most {similarity:.3f} (below threshold) for '{source_track.name}'"
             )
 
     logger.info(
@@ -100,57 +215,331 @@ def search_with_quality_fallbacks(service, source_track):
     return None
 
 
-@shared_task(bind=True)
-def generate_spotify_playlist(self, url):
-    url = strip_qs(url)
-    logger.info(f"Generating spotify equivalent of apple music playlist:{url}")
-    progress_recorder = ProgressRecorder(self)
+def prefetch_isrc_matches(service, source_tracks):
+    """
+    Resolve the ISRCs of many tracks in a few batched requests and seed the
+    search_with_isrc cache with the results, for services that support it.
+    """
+    if service.isrc_batch_size <= 1:
+        return
 
-    source_service = AppleMusicService()
-    destination_service = SpotifyService()
+    keys = {
+        search_isrc_cache_key(service, track): track.isrc.upper()
+        for track in source_tracks
+        if track.isrc
+    }
+    try:
+        cached = cache.get_many(keys)
+    except Exception:
+        return
+    isrcs = {isrc for key, isrc in keys.items() if key not in cached}
+    if not isrcs:
+        return
 
-    playlist_id = APPLE_MUSIC_PLAYLIST_URL_PAT.match(url).group("playlist_id")
-    storefront = APPLE_MUSIC_PLAYLIST_URL_PAT.match(url).group("storefront")
-    source_playlist = source_service.get_playlist(playlist_id, storefront=storefront)
+    try:
+        results = service.search_tracks_by_isrcs(isrcs)
+    except Exception as e:
+        logger.error(f"Error resolving {len(isrcs)} ISRC(s): {e}")
+        return
+    set_many(
+        {key: results.get(isrc, []) for key, isrc in keys.items() if key not in cached},
+        timeout=settings.SEARCH_CACHE_TIMEOUTS["isrc"],
+    )
+    logger.info(
+        f"Resolved {len(isrcs)} ISRC(s) in batches of {service.isrc_batch_size}"
+    )
 
-    track_ids = []
-    missed_tracks = []
-    n = len(source_playlist.tracks)
 
-    for i, source_track in enumerate(source_playlist.tracks):
-        try:
-            best_match = search_with_quality_fallbacks(
-                destination_service, source_track
-            )
+def missed_track_cache_key(source_service, track, destination_service):
+    return f"{source_service}:{track.id}:{destination_service}:missed"
+
+
+def get_known_misses(source_service, destination_service, source_tracks):
+    """Return ids of source tracks that recently failed to match"""
+    # Tracks without an id, like local files, cannot be told apart
+    keys = {
+        missed_track_cache_key(source_service, track, destination_service): track.id
+        for track in source_tracks
+        if track.id
+    }
+    try:
+        return {keys[key] for key in cache.get_many(keys)}
+    except Exception:
+        return set()
+
+
+def save_misses(source_service, destination_service, source_tracks):
+    try:
+        cache.set_many(
+            {
+                missed_track_cache_key(source_service, track, destination_service): 1
+                for track in source_tracks
+                if track.id
+            },
+            timeout=settings.MISSED_TRACK_CACHE_TIMEOUT,
+        )
+    except Exception:
+        pass
 
-            if best_match:
-                track_ids.append(best_match.id)
+
+def match_track(service, source_track, strategy_stats=None):
+    """
+    Search for a single track, treating any error as a miss. Returns the best
+    match, if any, and whether the search failed.
+    """
+    try:
+        return (
+            search_with_quality_fallbacks(service, source_track, strategy_stats),
+            False,
+        )
+    except Exception as e:
+        logger.error(f"Error processing track {source_track.name}: {e}")
+        return None, True
+
+
+class PlaylistMatcher:
+    """
+    Matches the tracks of one playlist, fed to it page by page with `add`.
+
+    The whole playlist shares one pool of searches, one StrategyStats and one
+    index of the tracks seen so far. Searches for a page start as soon as it
+    is added, while earlier ones still run, and a track repeated anywhere in
+    the playlist, by id or by ISRC, is matched once. Tracks with neither, like
+    Spotify local files, are always matched on their own.
+    """
+
+    def __init__(self, source_service, destination_service, progress_recorder):
+        self.source_service = source_service
+        self.destination_service = destination_service
+        self.progress_recorder = progress_recorder
+        self.strategy_stats = StrategyStats(source_service, destination_service)
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.MATCHING_CONCURRENCY.get(str(destination_service), 1)
+        )
+        self.source_tracks = []
+        # Index into unique_tracks of every source track
+        self.indexes = []
+        self.unique_tracks = []
+        self.occurrences = collections.Counter()
+        self.seen = {}
+        # Destination track id, or None, of every decided unique track
+        self.matches = {}
+        # Undecided unique tracks in playlist order, with their known match or
+        # their search
+        self.pending = collections.deque()
+        self.new_matches = []
+        self.new_misses = []
+        self.known = 0
+        self.processed = 0
+        self.total = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(cancel_futures=True)
+
+    def _unique_index(self, track):
+        keys = []
+        if track.id:
+            keys.append(("id", track.id))
+        if track.isrc:
+            keys.append(("isrc", track.isrc.upper()))
+        index = next((self.seen[key] for key in keys if key in self.seen), None)
+        new = index is None
+        if new:
+            index = len(self.unique_tracks)
+            self.unique_tracks.append(track)
+        for key in keys:
+            self.seen.setdefault(key, index)
+        return index, new
+
+    def add(self, source_tracks, total=None):
+        """
+        Start matching more source tracks. `total` is the size of the whole
+        playlist, if known, for progress reports.
+        """
+        new_indexes = []
+        for track in source_tracks:
+            index, new = self._unique_index(track)
+            if new:
+                new_indexes.append(index)
+            elif index in self.matches:
+                self.processed += 1
+            self.occurrences[index] += 1
+            self.source_tracks.append(track)
+            self.indexes.append(index)
+        self.total = max(total or 0, len(self.source_tracks))
+
+        new_tracks = [self.unique_tracks[index] for index in new_indexes]
+        known_matches = get_track_mappings(
+            self.source_service, self.destination_service, new_tracks
+        )
+        known_misses = get_known_misses(
+            self.source_service, self.destination_service, new_tracks
+        )
+        self.known += len(known_matches) + len(known_misses)
+        unknown_tracks = [
+            track
+            for track in new_tracks
+            if track.id not in known_matches and track.id not in known_misses
+        ]
+        prefetch_isrc_matches(self.destination_service, unknown_tracks)
+
+        for index, track in zip(new_indexes, new_tracks):
+            if track.id in known_matches:
+                self.pending.append((index, known_matches[track.id]))
+            elif track.id in known_misses:
+                self.pending.append((index, None))
+            else:
+                self.pending.append(
+                    (
+                        index,
+                        self.executor.submit(
+                            match_track,
+                            self.destination_service,
+                            track,
+                            strategy_stats=self.strategy_stats,
+                        ),
+                    )
+                )
+        self._collect(wait=False)
+
+    def _collect(self, wait):
+        """Decide pending tracks in playlist order, as long as they are ready"""
+        while self.pending:
+            index, match = self.pending[0]
+            if isinstance(match, Future):
+                if not (wait or match.done()):
+                    break
+                source_track = self.unique_tracks[index]
+                best_match, failed = match.result()
+                if best_match is not None:
+                    match = best_match.id
+                    self.new_matches.append((source_track, best_match))
+                else:
+                    match = None
+                    if not failed:
+                        self.new_misses.append(source_track)
+            self.pending.popleft()
+            self.matches[index] = match
+            self.progress_recorder.record_track(
+                self.unique_tracks[index], match is not None
+            )
+            self.processed += self.occurrences[index]
+        self.progress_recorder.set_progress(self.processed, self.total)
+
+    def results(self):
+        """
+        Wait for every track added to be decided and record the new matches
+        and misses. Returns the matched destination track ids and the missed
+        tracks, with an entry for every occurrence of a repeated track.
+        """
+        self._collect(wait=True)
+        logger.info(
+            f"Found {len(self.source_tracks) - len(self.unique_tracks)} repeated "
+            f"and {self.known} previously matched or missed track(s)"
+        )
+        save_track_mappings(
+            self.source_service, self.destination_service, self.new_matches
+        )
+        save_misses(self.source_service, self.destination_service, self.new_misses)
+        self.strategy_stats.save()
+
+        track_ids = []
+        missed_tracks = []
+        for source_track, index in zip(self.source_tracks, self.indexes):
+            if self.matches[index] is not None:
+                track_ids.append(self.matches[index])
             else:
                 missed_tracks.append(source_track.to_dict())
+        return track_ids, missed_tracks
+
+
+def match_tracks(source_service, destination_service, source_tracks, progress_recorder):
+    """
+    Find the destination equivalent of every source track. Returns the matched
+    destination track ids and the missed tracks, in playlist order.
+    """
+    with PlaylistMatcher(
+        source_service, destination_service, progress_recorder
+    ) as matcher:
+        matcher.add(source_tracks)
+        return matcher.results()
+
+
+def get_service(name, access_token=None):
+    if name == "spotify":
+        return SpotifyService()
+    return AppleMusicService(access_token=access_token)
+
+
+def fan_out(
+    task, source_service, destination_service, source_tracks, callback, **kwargs
+):
+    """
+    Split matching of a large playlist into chunks matched by subtasks on any
+    worker, with `callback` receiving their results in playlist order. The
+    callback inherits the id of `task`, so progress and the final result keep
+    being reported where the frontend polls for them.
+    """
+    chunks = list(grouper(settings.CONVERSION_CHUNK_SIZE, source_tracks))
+    logger.info(f"Splitting {len(source_tracks)} track(s) into {len(chunks)} chunks")
+    # Chunks stay on the queue the conversion was routed to by size
+    queue = (task.request.delivery_info or {}).get("routing_key")
+    options = {"queue": queue} if queue else {}
+    header = group(
+        match_playlist_chunk.s(
+            str(source_service),
+            str(destination_service),
+            [track.to_dict() for track in chunk],
+            task.request.id,
+            len(source_tracks),
+            **kwargs,
+        ).set(**options)
+        for chunk in chunks
+    )
+    return task.replace(chord(header, callback.set(**options)))
 
-        except Exception as e:
-            missed_tracks.append(source_track.to_dict())
-            logger.error(f"Error processing track {source_track.name}: {e}")
-            continue
-        finally:
-            progress_recorder.set_progress(i + 1, n)
 
-    destination_playlist_id = destination_service.create_playlist(
-        name=source_playlist.name,
-        description=f"Made with Playlistor (https://playlistor.io) :)",
-        track_ids=track_ids,
+def merge_chunks(results):
+    track_ids = []
+    missed_tracks = []
+    for chunk_track_ids, chunk_missed_tracks in results:
+        track_ids.extend(chunk_track_ids)
+        missed_tracks.extend(chunk_missed_tracks)
+    return track_ids, missed_tracks
+
+
+@shared_task(bind=True)
+def match_playlist_chunk(
+    self, source, destination, tracks, parent_task_id, total, access_token=None
+):
+    progress_recorder = ChunkProgressRecorder(self, parent_task_id, total)
+    result = match_tracks(
+        get_service(source),
+        get_service(destination, access_token=access_token),
+        [Track(**track) for track in tracks],
+        progress_recorder,
     )
+    progress_recorder.flush()
+    return result
+
 
+def spotify_playlist_result(
+    url, name, artwork_url, creator, destination_playlist_id, n, missed_tracks
+):
     playlist_url = f"https://open.spotify.com/playlist/{destination_playlist_id}"
 
     counters.incr_playlist_counter()
     logger.info(f"Missed {len(missed_tracks)} in {n} track(s)")
+    logger.info(f"String similarity memo: {similarity_cache_info()}")
     Playlist.objects.create(
-        name=source_playlist.name,
-        artwork_url=source_playlist.artwork_url,
+        name=name,
+        artwork_url=artwork_url,
         spotify_url=playlist_url,
         applemusic_url=url,
-        creator=source_playlist.creator,
+        creator=creator,
     )
     return {
         "playlist_url": playlist_url,
@@ -161,56 +550,224 @@ def generate_spotify_playlist(self, url):
     }
 
 
-@shared_task(bind=True)
-def generate_applemusic_playlist(self, url, access_token):
-    url = strip_qs(url)
-    logger.info(f"Generating apple music equivalent of spotify playlist:{url}")
-    progress_recorder = ProgressRecorder(self)
-    playlist_id = SPOTIFY_PLAYLIST_URL_PAT.match(url).group("playlist_id")
-    source_service = SpotifyService()
-    destination_service = AppleMusicService(access_token=access_token)
+def applemusic_playlist_result(n, missed_tracks):
+    counters.incr_playlist_counter()
+    logger.info(f"Missed {len(missed_tracks)} in {n} track(s)")
+    logger.info(f"String similarity memo: {similarity_cache_info()}")
+    return {
+        "playlist_url": None,
+        "number_of_tracks": n,
+        "missed_tracks": missed_tracks,
+        "source": "spotify",
+        "destination": "apple-music",
+    }
 
-    source_playlist = source_service.get_playlist(playlist_id)
 
-    track_ids = []
-    missed_tracks = []
-    n = len(source_playlist.tracks)
-    for i, source_track in enumerate(source_playlist.tracks):
-        try:
-            # Use functional fallback search approach
-            best_match = search_with_quality_fallbacks(
-                destination_service, source_track
-            )
+def create_spotify_playlist(url, name, artwork_url, creator, track_ids, missed_tracks):
+    destination_service = SpotifyService()
+    n = len(track_ids) + len(missed_tracks)
 
-            if best_match:
-                track_ids.append(best_match.id)
-            else:
-                missed_tracks.append(source_track.to_dict())
-        except Exception as e:
-            logger.error(f"Error processing track {source_track.name}: {e}")
-            missed_tracks.append(source_track.to_dict())
-            continue
-        finally:
-            progress_recorder.set_progress(i + 1, n)
+    destination_playlist_id = destination_service.create_playlist(
+        name=name,
+        description=PLAYLIST_DESCRIPTION,
+        track_ids=track_ids,
+    )
+    return spotify_playlist_result(
+        url, name, artwork_url, creator, destination_playlist_id, n, missed_tracks
+    )
+
+
+def create_applemusic_playlist(task, access_token, name, track_ids, missed_tracks):
+    destination_service = AppleMusicService(access_token=access_token)
+    n = len(track_ids) + len(missed_tracks)
     try:
-        destination_playlist_id = destination_service.create_playlist(
-            name=source_playlist.name,
-            description=f"Made with Playlistor (https://playlistor.io) :)",
+        destination_service.create_playlist(
+            name=name,
+            description=PLAYLIST_DESCRIPTION,
             track_ids=track_ids,
         )
 
     except requests.exceptions.HTTPError as e:
         response = e.response
         if response.status_code >= 500:
-            raise self.retry(exc=e, countdown=30)
+            raise task.retry(exc=e, countdown=30)
         else:
             raise e
-    counters.incr_playlist_counter()
-    logger.info(f"Missed {len(missed_tracks)} in {n} track(s)")
-    return {
-        "playlist_url": None,
-        "number_of_tracks": n,
-        "missed_tracks": missed_tracks,
-        "source": "spotify",
-        "destination": "apple-music",
-    }
+    return applemusic_playlist_result(n, missed_tracks)
+
+
+@shared_task(bind=True)
+def finish_spotify_playlist(self, results, url, name, artwork_url, creator):
+    track_ids, missed_tracks = merge_chunks(results)
+    return create_spotify_playlist(
+        url, name, artwork_url, creator, track_ids, missed_tracks
+    )
+
+
+@shared_task(bind=True)
+def finish_applemusic_playlist(self, results, access_token, name):
+    track_ids, missed_tracks = merge_chunks(results)
+    return create_applemusic_playlist(
+        self, access_token, name, track_ids, missed_tracks
+    )
+
+
+def stream_source_playlist(source_service, playlist_id, storefront=None):
+    """
+    Fetch a playlist page by page, caching it once all pages went by.
+    Simultaneous conversions of the playlist wait for that copy instead of
+    fetching it too, and get it whole, without pages.
+    """
+    key = playlist_cache_key(source_service, playlist_id, storefront)
+    locked = lock(key)
+    if not locked:
+        source_playlist, locked = wait_for(key)
+        if source_playlist is not None:
+            return source_playlist, None
+    try:
+        source_playlist, pages = source_service.iter_playlist(
+            playlist_id, storefront=storefront
+        )
+    except BaseException:
+        if locked:
+            unlock(key)
+        raise
+    return source_playlist, cache_pages(
+        source_service, source_playlist, pages, storefront, locked=locked
+    )
+
+
+def open_source_playlist(source_service, playlist_id, storefront=None):
+    """
+    Fetch a playlist to convert, reusing a cached copy while it is current.
+
+    Playlists longer than settings.CONVERSION_CHUNK_SIZE are fetched whole, to
+    be split between workers, and are returned without pages. Others are
+    returned with an iterator over pages of their tracks, so matching can
+    start as soon as the first page arrives.
+    """
+    source_playlist = get_cached_playlist(source_service, playlist_id, storefront)
+    if source_playlist is None:
+        size = get_playlist_size(str(source_service), playlist_id)
+        if size is None or size <= settings.CONVERSION_CHUNK_SIZE:
+            source_playlist, pages = stream_source_playlist(
+                source_service, playlist_id, storefront
+            )
+            if pages is not None:
+                size = source_playlist.total_tracks or size
+                if size is None or size <= settings.CONVERSION_CHUNK_SIZE:
+                    source_playlist.total_tracks = size
+                    return source_playlist, pages
+                source_playlist.tracks = [track for page in pages for track in page]
+                cache_playlist(source_service, source_playlist, storefront)
+        else:
+            source_playlist = get_playlist(
+                source_service, playlist_id, storefront=storefront
+            )
+    save_playlist_size(source_service, playlist_id, len(source_playlist.tracks))
+    if len(source_playlist.tracks) > settings.CONVERSION_CHUNK_SIZE:
+        return source_playlist, None
+    return source_playlist, iter([source_playlist.tracks])
+
+
+def stream_matches(
+    source_service, destination_service, source_playlist, pages, progress_recorder
+):
+    """
+    Match pages of source tracks while the next pages are fetched. Returns the
+    matched destination track ids and the missed tracks, once all pages are
+    matched, so nothing is written to the destination before then.
+    """
+    with PlaylistMatcher(
+        source_service, destination_service, progress_recorder
+    ) as matcher:
+        for page in prefetch(pages):
+            matcher.add(page, total=source_playlist.total_tracks)
+        track_ids, missed_tracks = matcher.results()
+    save_playlist_size(
+        source_service, source_playlist.id, len(track_ids) + len(missed_tracks)
+    )
+    return track_ids, missed_tracks
+
+
+@shared_task(bind=True)
+def generate_spotify_playlist(self, url):
+    url = strip_qs(url)
+    logger.info(f"Generating spotify equivalent of apple music playlist:{url}")
+    progress_recorder = ThrottledProgressRecorder(self)
+
+    source_service = AppleMusicService()
+    destination_service = SpotifyService()
+
+    playlist_id = APPLE_MUSIC_PLAYLIST_URL_PAT.match(url).group("playlist_id")
+    storefront = APPLE_MUSIC_PLAYLIST_URL_PAT.match(url).group("storefront")
+    source_playlist, pages = open_source_playlist(
+        source_service, playlist_id, storefront=storefront
+    )
+
+    if pages is None:
+        return fan_out(
+            self,
+            source_service,
+            destination_service,
+            source_playlist.tracks,
+            finish_spotify_playlist.s(
+                url=url,
+                name=source_playlist.name,
+                artwork_url=source_playlist.artwork_url,
+                creator=source_playlist.creator,
+            ),
+        )
+
+    track_ids, missed_tracks = stream_matches(
+        source_service, destination_service, source_playlist, pages, progress_recorder
+    )
+    progress_recorder.flush()
+    return create_spotify_playlist(
+        url,
+        source_playlist.name,
+        source_playlist.artwork_url,
+        source_playlist.creator,
+        track_ids,
+        missed_tracks,
+    )
+
+
+@shared_task(bind=True)
+def generate_applemusic_playlist(self, url, access_token):
+    url = strip_qs(url)
+    logger.info(f"Generating apple music equivalent of spotify playlist:{url}")
+    progress_recorder = ThrottledProgressRecorder(self)
+    playlist_id = SPOTIFY_PLAYLIST_URL_PAT.match(url).group("playlist_id")
+    source_service = SpotifyService()
+    destination_service = AppleMusicService(access_token=access_token)
+
+    source_playlist, pages = open_source_playlist(source_service, playlist_id)
+
+    if pages is None:
+        return fan_out(
+            self,
+            source_service,
+            destination_service,
+            source_playlist.tracks,
+            finish_applemusic_playlist.s(
+                access_token=access_token, name=source_playlist.name
+            ),
+            access_token=access_token,
+        )
+
+    track_ids, missed_tracks = stream_matches(
+        source_service, destination_service, source_playlist, pages, progress_recorder
+    )
+    progress_recorder.flush()
+    return create_applemusic_playlist(
+        self, access_token, source_playlist.name, track_ids, missed_tracks
+    )
+
+
+@task_postrun.connect
+def publish_task_done(task_id=None, state=None, **kwargs):
+    # Lets event streams know the final result is stored. Chord callbacks
+    # share the id of the task they replaced, so they are covered too.
+    if state in states.READY_STATES:
+        ConversionEvents(task_id).publish("done")
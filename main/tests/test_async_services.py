@@ -0,0 +1,198 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from django.test import SimpleTestCase, override_settings
+
+from main.services import AsyncAppleMusicService
+
+PLAYLIST_SIZE = 950
+FIRST_PAGE_SIZE = 100
+
+
+def raw_song(i):
+    return {
+        "id": str(i),
+        "attributes": {
+            "name": f"Song {i}",
+            "artistName": "Artist & Guest",
+            "albumName": "Album",
+            "durationInMillis": 200000,
+            "isrc": f"USAAA{i:07d}",
+        },
+    }
+
+
+class StubAppleMusicHandler(BaseHTTPRequestHandler):
+    """Just enough of the Apple Music API for AsyncAppleMusicService"""
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body=None):
+        content = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, None))
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/v1/catalog/us/playlists/pl.1":
+            return self.respond(
+                200,
+                {
+                    "data": [
+                        {
+                            "attributes": {
+                                "name": "Stub Playlist",
+                                "curatorName": "Curator",
+                                "lastModifiedDate": "2024-01-01",
+                            },
+                            "relationships": {
+                                "tracks": {
+                                    "data": [
+                                        raw_song(i) for i in range(FIRST_PAGE_SIZE)
+                                    ],
+                                    "next": "/v1/catalog/us/playlists/pl.1/tracks"
+                                    f"?offset={FIRST_PAGE_SIZE}",
+                                }
+                            },
+                        }
+                    ]
+                },
+            )
+        if url.path == "/v1/catalog/us/playlists/pl.1/tracks":
+            offset, limit = int(query["offset"][0]), int(query["limit"][0])
+            if offset >= PLAYLIST_SIZE:
+                return self.respond(404, {"errors": []})
+            end = min(offset + limit, PLAYLIST_SIZE)
+            page = {"data": [raw_song(i) for i in range(offset, end)]}
+            if end < PLAYLIST_SIZE:
+                page["next"] = f"/v1/catalog/us/playlists/pl.1/tracks?offset={end}"
+            return self.respond(200, page)
+        if url.path == "/v1/catalog/us/songs":
+            isrcs = query["filter[isrc]"][0].split(",")
+            return self.respond(
+                200, {"data": [raw_song(int(isrc[5:])) for isrc in isrcs]}
+            )
+        if url.path == "/v1/catalog/us/search":
+            return self.respond(
+                200, {"results": {"songs": {"data": [raw_song(1), raw_song(2)]}}}
+            )
+        self.respond(404, {"errors": []})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.command, self.path, body))
+        if self.path == "/v1/me/library/playlists":
+            return self.respond(201, {"data": [{"id": "p.new"}]})
+        self.respond(204)
+
+
+def private_key():
+    return (
+        ec.generate_private_key(ec.SECP256R1())
+        .private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+        .decode()
+    )
+
+
+class AsyncAppleMusicServiceTestCase(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubAppleMusicHandler)
+        cls.server.requests = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+        cls.enterClassContext(
+            override_settings(
+                APPLE_TEAM_ID="team",
+                APPLE_KEY_ID="key",
+                APPLE_PRIVATE_KEY=private_key(),
+                RESPONSE_CACHE_ENABLED=False,
+            )
+        )
+        # Not pacing requests keeps the tests off Redis
+        cls.enterClassContext(
+            mock.patch("main.ratelimit.RateLimiter._wait", return_value=0)
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests.clear()
+
+    def run_with_service(self, func):
+        async def run():
+            async with AsyncAppleMusicService(
+                access_token="user-token", base_url=self.base_url
+            ) as service:
+                return await func(service)
+
+        return asyncio.run(run())
+
+    def test_get_playlist_fetches_every_page(self):
+        playlist = self.run_with_service(lambda service: service.get_playlist("pl.1"))
+        self.assertEqual(playlist.name, "Stub Playlist")
+        self.assertEqual(playlist.creator, "Curator")
+        self.assertEqual(playlist.version, "2024-01-01")
+        self.assertEqual(
+            [track.id for track in playlist.tracks],
+            [str(i) for i in range(PLAYLIST_SIZE)],
+        )
+        self.assertEqual(playlist.tracks[0].artists, ["Artist", "Guest"])
+
+    def test_search_track(self):
+        tracks = self.run_with_service(
+            lambda service: service.search_track("Song 1 Artist")
+        )
+        self.assertEqual([track.id for track in tracks], ["1", "2"])
+
+    def test_search_tracks_by_isrcs_batches_requests(self):
+        isrcs = [f"USAAA{i:07d}" for i in range(60)]
+        tracks = self.run_with_service(
+            lambda service: service.search_tracks_by_isrcs(isrcs)
+        )
+        self.assertEqual(
+            {isrc: [t.isrc for t in tracks[isrc]] for isrc in isrcs},
+            {isrc: [isrc] for isrc in isrcs},
+        )
+        # Up to 25 ISRCs per request
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_create_playlist_adds_tracks_in_order(self):
+        track_ids = [str(i) for i in range(250)]
+        playlist_id = self.run_with_service(
+            lambda service: service.create_playlist(
+                "New", description="Made here", track_ids=track_ids
+            )
+        )
+        self.assertEqual(playlist_id, "p.new")
+        sent = []
+        for method, path, body in self.server.requests:
+            self.assertEqual(method, "POST")
+            if path == "/v1/me/library/playlists":
+                self.assertEqual(body["attributes"]["name"], "New")
+                sent.extend(t["id"] for t in body["relationships"]["tracks"]["data"])
+            else:
+                self.assertEqual(path, "/v1/me/library/playlists/p.new/tracks")
+                sent.extend(t["id"] for t in body["data"])
+        self.assertEqual(sent, track_ids)
@@ -0,0 +1,68 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from main.cache import cache_with_key
+
+
+class CoalescingTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch("main.cache.WAIT_INTERVAL", 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_concurrently(self, func, callers=4):
+        barrier = threading.Barrier(callers)
+        results = []
+
+        def call():
+            barrier.wait()
+            try:
+                results.append(func())
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_waiters_get_the_leaders_value(self):
+        calls = []
+
+        @cache_with_key(lambda: "coalesce:ok", timeout=60)
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = self.run_concurrently(fetch)
+
+        self.assertEqual(results, ["value"] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_one_waiter_takes_over_when_the_leader_fails(self):
+        calls = []
+
+        @cache_with_key(lambda: "coalesce:failing", timeout=60)
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            if len(calls) == 1:
+                raise RuntimeError("upstream 503")
+            return "value"
+
+        start = time.monotonic()
+        results = self.run_concurrently(fetch)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sum(isinstance(r, RuntimeError) for r in results), 1)
+        self.assertEqual(results.count("value"), 3)
+        # Nobody sat out WAIT_TIMEOUT
+        self.assertLess(time.monotonic() - start, 2)
@@ -0,0 +1,142 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from main import models
+from main.data_models import Track
+from main.tasks import match_tracks, missed_track_cache_key
+
+
+class FakeService:
+    isrc_batch_size = 1
+
+    storefront = None
+
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeProgressRecorder:
+    def __init__(self):
+        self.decided = []
+        self.progress = None
+
+    def record_track(self, source_track, matched):
+        self.decided.append((source_track, matched))
+
+    def set_progress(self, current, total, description=""):
+        self.progress = (current, total)
+
+
+SOURCE = FakeService("spotify")
+DESTINATION = FakeService("apple-music")
+
+
+class MatchTracksTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.searched = []
+        patchers = [
+            mock.patch("main.tasks.match_track", side_effect=self.match_track),
+            mock.patch("main.tasks.StrategyStats"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.progress_recorder = FakeProgressRecorder()
+
+    def match_track(self, service, source_track, strategy_stats=None):
+        # Tracks named "missing ..." have no match, others match a destination
+        # track named after them
+        self.searched.append(source_track)
+        if source_track.name.startswith("missing"):
+            return None, False
+        destination_track = Track(
+            id=f"am-{source_track.name}",
+            name=source_track.name,
+            artists=source_track.artists,
+        )
+        return destination_track, False
+
+    def match(self, source_tracks):
+        return match_tracks(SOURCE, DESTINATION, source_tracks, self.progress_recorder)
+
+    def test_tracks_without_an_id_are_matched_on_their_own(self):
+        tracks = [
+            Track(id=None, name="local", artists=["Me"]),
+            Track(id=None, name="local", artists=["Me"]),
+            Track(id=None, name="missing local", artists=["Me"]),
+        ]
+
+        track_ids, missed_tracks = self.match(tracks)
+
+        self.assertEqual(len(self.searched), 3)
+        self.assertEqual(track_ids, ["am-local", "am-local"])
+        self.assertEqual([track["id"] for track in missed_tracks], [None])
+
+    def test_tracks_without_an_id_are_not_remembered(self):
+        tracks = [
+            Track(id=None, name="local", artists=["Me"]),
+            Track(id=None, name="missing local", artists=["Me"]),
+        ]
+
+        self.match(tracks)
+
+        self.assertFalse(models.Track.objects.exists())
+        self.assertIsNone(
+            cache.get(missed_track_cache_key(SOURCE, tracks[1], DESTINATION))
+        )
+        # Nor are they looked up as known misses on the next conversion
+        self.searched.clear()
+        self.match(tracks)
+        self.assertEqual(len(self.searched), 2)
+
+    def test_tracks_with_an_id_are_remembered(self):
+        tracks = [
+            Track(id="sp-1", name="song", artists=["Band"]),
+            Track(id="sp-2", name="missing song", artists=["Band"]),
+        ]
+
+        self.match(tracks)
+
+        self.assertEqual(
+            list(models.Track.objects.values_list("spotify_id", "apple_music_id")),
+            [("sp-1", "am-song")],
+        )
+        self.assertIsNotNone(
+            cache.get(missed_track_cache_key(SOURCE, tracks[1], DESTINATION))
+        )
+        self.searched.clear()
+        self.assertEqual(self.match(tracks), (["am-song"], [tracks[1].to_dict()]))
+        self.assertEqual(self.searched, [])
+
+    def test_isrcs_are_compared_case_insensitively(self):
+        tracks = [
+            Track(id="sp-1", name="song", artists=["Band"], isrc="usabc2400001"),
+            Track(
+                id="sp-2", name="song (remaster)", artists=["Band"], isrc="USABC2400001"
+            ),
+        ]
+
+        track_ids, missed_tracks = self.match(tracks)
+
+        self.assertEqual([track.id for track in self.searched], ["sp-1"])
+        self.assertEqual(track_ids, ["am-song", "am-song"])
+        self.assertEqual(missed_tracks, [])
+
+    def test_results_cover_every_occurrence(self):
+        song = Track(id="sp-1", name="song", artists=["Band"])
+        missing = Track(id="sp-2", name="missing song", artists=["Band"])
+        tracks = [song, missing, song, missing, song]
+
+        track_ids, missed_tracks = self.match(tracks)
+
+        self.assertEqual(len(self.searched), 2)
+        self.assertEqual(track_ids, ["am-song"] * 3)
+        self.assertEqual(missed_tracks, [missing.to_dict()] * 2)
+        self.assertEqual(len(self.progress_recorder.decided), 2)
+        self.assertEqual(self.progress_recorder.progress, (5, 5))
@@ -0,0 +1,107 @@
+from django.test import SimpleTestCase
+
+from main.data_models import Track
+from main.matching import (
+    MATCH_THRESHOLD,
+    _similarity,
+    are_tracks_same,
+    best_match,
+    build_profile,
+    track_similarity,
+)
+
+
+def make_track(id, name, artists, album=None, duration_ms=None, isrc=None):
+    return Track(
+        id=id,
+        name=name,
+        artists=artists,
+        album=album,
+        duration_ms=duration_ms,
+        isrc=isrc,
+    )
+
+
+SOURCE = make_track(
+    "s1", "Blinding Lights", ["The Weeknd"], "After Hours", 200040, "USUG11904206"
+)
+
+CANDIDATES = [
+    make_track("c1", "Blinding Lights (Live)", ["The Weeknd"], "Live at SoFi", 210000),
+    make_track("c2", "Blinding Lights", ["The Weeknd"], "After Hours", 201000),
+    make_track("c3", "Save Your Tears", ["The Weeknd"], "After Hours", 215000),
+    make_track("c4", "Blinding Lights", ["Some Cover Band"], "Covers Vol. 3", 180000),
+    make_track("c5", "Lights", ["Ellie Goulding"], "Bright Lights", 211000),
+]
+
+
+class SimilarityTestCase(SimpleTestCase):
+    def test_same_track_differing_only_in_length(self):
+        # One second apart costs a fifth of the length feature's weight
+        self.assertAlmostEqual(
+            track_similarity(SOURCE, CANDIDATES[1]), 1 - 0.2 * 20 / 120
+        )
+        self.assertTrue(are_tracks_same(SOURCE, CANDIDATES[1]))
+
+    def test_special_terms_veto_the_name(self):
+        self.assertLess(
+            track_similarity(SOURCE, CANDIDATES[0]),
+            track_similarity(SOURCE, CANDIDATES[1]),
+        )
+
+    def test_shared_isrc_is_not_a_match_by_itself(self):
+        unrelated = make_track(
+            "u1", "Karaoke Hits", ["Nobody"], "Sing Along", 95000, SOURCE.isrc
+        )
+        self.assertLess(track_similarity(SOURCE, unrelated), MATCH_THRESHOLD)
+        self.assertFalse(are_tracks_same(SOURCE, unrelated))
+        self.assertEqual(best_match(SOURCE, [unrelated])[0], None)
+
+    def test_bounds_fall_on_the_same_side_as_the_exact_score(self):
+        source = build_profile(SOURCE)
+        for candidate in CANDIDATES:
+            exact = track_similarity(SOURCE, candidate)
+            profile = build_profile(candidate)
+            for bound in (0.3, 0.5, MATCH_THRESHOLD, 0.9):
+                with self.subTest(candidate=candidate.id, bound=bound):
+                    upper = _similarity(source, profile, floor=bound)
+                    lower = _similarity(source, profile, ceiling=bound)
+                    self.assertEqual(upper < bound, exact < bound)
+                    self.assertGreaterEqual(upper, exact)
+                    self.assertEqual(lower >= bound, exact >= bound)
+                    self.assertLessEqual(lower, exact)
+
+    def test_are_tracks_same_agrees_with_track_similarity(self):
+        for candidate in CANDIDATES:
+            with self.subTest(candidate=candidate.id):
+                self.assertEqual(
+                    are_tracks_same(SOURCE, candidate),
+                    track_similarity(SOURCE, candidate) >= MATCH_THRESHOLD,
+                )
+
+
+class BestMatchTestCase(SimpleTestCase):
+    def test_returns_best_candidate_with_exact_score(self):
+        match, score = best_match(SOURCE, CANDIDATES)
+        scores = [track_similarity(SOURCE, candidate) for candidate in CANDIDATES]
+        self.assertEqual(match, CANDIDATES[scores.index(max(scores))])
+        self.assertEqual(score, max(scores))
+
+    def test_order_of_candidates_does_not_matter(self):
+        self.assertEqual(
+            best_match(SOURCE, CANDIDATES)[0],
+            best_match(SOURCE, list(reversed(CANDIDATES)))[0],
+        )
+
+    def test_no_match_below_threshold(self):
+        candidates = [CANDIDATES[2], CANDIDATES[4]]
+        match, score = best_match(SOURCE, candidates)
+        self.assertIsNone(match)
+        self.assertLess(score, MATCH_THRESHOLD)
+        # An upper bound of the best score
+        self.assertGreaterEqual(
+            score, max(track_similarity(SOURCE, c) for c in candidates)
+        )
+
+    def test_no_candidates(self):
+        self.assertEqual(best_match(SOURCE, []), (None, 0.0))
@@ -0,0 +1,35 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from main.ratelimit import RateLimiter
+
+
+class AsyncRateLimiterTestCase(SimpleTestCase):
+    def test_waiting_requests_do_not_hold_threads(self):
+        limiter = RateLimiter("apple-music", rate=10)
+        waited = set()
+
+        def wait(url):
+            # Every request waits once before it may be sent
+            if url in waited:
+                return 0
+            waited.add(url)
+            return 0.2
+
+        async def acquire_all():
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(ThreadPoolExecutor(max_workers=2))
+            await asyncio.gather(
+                *(limiter.aacquire(f"https://api/v1/catalog/{i}") for i in range(200))
+            )
+
+        with mock.patch.object(limiter, "_wait", side_effect=wait):
+            start = time.monotonic()
+            asyncio.run(acquire_all())
+
+        # Sleeping in two threads would take 20s
+        self.assertLess(time.monotonic() - start, 2)
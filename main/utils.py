@@ -1,11 +1,9 @@
-import datetime
 import functools
 import itertools
 import re
 import subprocess
 from urllib.parse import urlsplit
 
-import jwt
 import redis
 import requests
 from django.conf import settings
@@ -16,7 +14,13 @@ from spotipy import Spotify
 
 from main import oauth_manager
 
-from .client import AppleMusicClient
+from .client import (
+    BASE_URL,
+    BROWSER_DEVELOPER_TOKEN_MIN_LIFETIME,
+    AppleMusicClient,
+    AsyncAppleMusicClient,
+    get_developer_token_provider,
+)
 
 SPOTIFY_PLAYLIST_URL_PAT = re.compile(
     r"http(s)?:\/\/open.spotify.com/(user\/.+\/)?playlist/(?P<playlist_id>[^\s?]+)"
@@ -47,13 +51,32 @@ def requests_retry_session(
     return session
 
 
-def get_spotify_client():
-    return Spotify(oauth_manager=oauth_manager)
+def get_spotify_client(requests_session=True):
+    return Spotify(oauth_manager=oauth_manager, requests_session=requests_session)
 
 
-def get_applemusic_client():
+def get_applemusic_client(rate_limiter=None, response_cache=None):
     return AppleMusicClient(
-        settings.APPLE_TEAM_ID, settings.APPLE_KEY_ID, settings.APPLE_PRIVATE_KEY
+        settings.APPLE_TEAM_ID,
+        settings.APPLE_KEY_ID,
+        settings.APPLE_PRIVATE_KEY,
+        rate_limiter=rate_limiter,
+        response_cache=response_cache,
+        pool_size=settings.APPLE_MUSIC_POOL_SIZE,
+    )
+
+
+def get_async_applemusic_client(
+    base_url=BASE_URL, rate_limiter=None, response_cache=None
+):
+    return AsyncAppleMusicClient(
+        settings.APPLE_TEAM_ID,
+        settings.APPLE_KEY_ID,
+        settings.APPLE_PRIVATE_KEY,
+        base_url=base_url,
+        rate_limiter=rate_limiter,
+        response_cache=response_cache,
+        pool_size=settings.APPLE_MUSIC_POOL_SIZE,
     )
 
 
@@ -66,24 +89,28 @@ def grouper(n, iterable):
         yield chunk
 
 
+@functools.lru_cache(maxsize=None)
+def _redis_client(url):
+    return redis.Redis.from_url(url)
+
+
 def get_redis_client():
-    return redis.Redis.from_url(settings.REDIS_URL)
+    """
+    The process-wide Redis client. Its connection pool is shared by every
+    caller instead of being set up per counter, limiter or cache.
+    """
+    return _redis_client(settings.REDIS_URL)
 
 
 def generate_auth_token() -> str:
-    # see https://developer.apple.com/documentation/applemusicapi/getting_keys_and_creating_tokens
-    time_now = datetime.datetime.now()
-    time_expired = time_now + datetime.timedelta(hours=12)
-    headers = {"alg": "ES256", "kid": settings.APPLE_KEY_ID}
-    payload = {
-        "iss": settings.APPLE_TEAM_ID,
-        "exp": int(time_expired.strftime("%s")),
-        "iat": int(time_now.strftime("%s")),
-    }
-    token = jwt.encode(
-        payload, settings.APPLE_PRIVATE_KEY, algorithm="ES256", headers=headers
-    )
-    return token
+    """
+    Apple Music developer token for MusicKit pages. It is the one
+    AppleMusicClient uses, replaced early if it has less than
+    BROWSER_DEVELOPER_TOKEN_MIN_LIFETIME left.
+    """
+    return get_developer_token_provider(
+        settings.APPLE_TEAM_ID, settings.APPLE_KEY_ID, settings.APPLE_PRIVATE_KEY
+    ).get(min_lifetime=BROWSER_DEVELOPER_TOKEN_MIN_LIFETIME)
 
 
 def strip_qs(url):
@@ -153,6 +180,15 @@ def parse_track_name(track_name):
     return {"track_name": clean_name, "featured_artists": featured_artists}
 
 
+def canonical_query(query):
+    """
+    Reduce a search query to a canonical form for use in cache keys: case
+    folded, with featured artists, punctuation and extra whitespace removed.
+    """
+    query = parse_track_name(query)["track_name"].casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", query).split())
+
+
 @functools.lru_cache(maxsize=128)
 def get_version():
     version = subprocess.check_output(
@@ -1,7 +1,10 @@
 import json
+import time
 
+from celery.result import AsyncResult
+from celery_progress.backend import Progress
 from django.core.exceptions import ValidationError as DjangoValidationError
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.views.decorators.http import require_POST
@@ -11,7 +14,9 @@ from jsonschema.exceptions import ValidationError as JsonSchemaValitadionError
 from main import oauth_manager
 
 from .decorators import login_required
+from .events import ConversionEvents
 from .models import Playlist, Subscriber
+from .routing import conversion_queue
 from .tasks import generate_applemusic_playlist, generate_spotify_playlist
 from .utils import (
     get_redis_client,
@@ -20,6 +25,15 @@ from .utils import (
     validate_spotify_playlist_url,
 )
 
+# Seconds between keep-alive comments on an idle event stream
+EVENTS_KEEPALIVE_SECONDS = 15
+
+# An event stream ends with a `timeout` event after this many seconds, or
+# after this many seconds of its task being unknown (PENDING), as are tasks
+# that expired or never existed. The page then falls back to polling.
+EVENTS_MAX_SECONDS = 3600
+EVENTS_PENDING_SECONDS = 300
+
 
 def login(request):
     authorize_url = oauth_manager.get_authorize_url()
@@ -59,10 +73,14 @@ def playlist(request):
         if platform == "apple-music":
             validate_spotify_playlist_url(playlist)
             token = request.headers.get("Music-User-Token")
-            result = generate_applemusic_playlist.delay(playlist, token)
+            result = generate_applemusic_playlist.apply_async(
+                (playlist, token), queue=conversion_queue(platform, playlist)
+            )
         elif platform == "spotify":
             validate_apple_music_playlist_url(playlist)
-            result = generate_spotify_playlist.delay(playlist)
+            result = generate_spotify_playlist.apply_async(
+                (playlist,), queue=conversion_queue(platform, playlist)
+            )
         else:
             return JsonResponse({"message": "Platform not supported"}, status=400)
     except DjangoValidationError as e:
@@ -70,6 +88,55 @@ def playlist(request):
     return JsonResponse({"task_id": result.task_id})
 
 
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def conversion_events(request, task_id):
+    """
+    Server-sent events stream of a conversion task. Sends `progress` events,
+    carrying the tracks decided since the previous one, while the task runs
+    and a final `result` event in the format of the celery_progress endpoint.
+    Streams of tasks that take too long, or stay unknown, end with a
+    `timeout` event instead.
+
+    Streams wait on Redis for as long as the conversion runs, so the site is
+    served by gevent workers (see gunicorn.conf.py), where a waiting stream
+    ties up a greenlet rather than a worker.
+    """
+    events = ConversionEvents(task_id)
+
+    def stream():
+        pubsub = events.subscribe()
+        try:
+            result = AsyncResult(task_id)
+            started_at = time.monotonic()
+            while not result.ready():
+                elapsed = time.monotonic() - started_at
+                if elapsed >= EVENTS_MAX_SECONDS or (
+                    elapsed >= EVENTS_PENDING_SECONDS and result.state == "PENDING"
+                ):
+                    yield format_event("timeout", None)
+                    return
+                message = pubsub.get_message(
+                    timeout=min(EVENTS_KEEPALIVE_SECONDS, EVENTS_MAX_SECONDS - elapsed)
+                )
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = json.loads(message["data"])
+                if event["event"] != "done":
+                    yield format_event(event["event"], event["data"])
+            yield format_event("result", Progress(result).get_info())
+        finally:
+            pubsub.close()
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 @require_POST
 def expand(request):
     data = json.loads(request.body.decode("utf-8"))
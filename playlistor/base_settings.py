@@ -122,8 +122,84 @@ APPLE_PRIVATE_KEY = get_secret("APPLE_PRIVATE_KEY") or get_from_file_if_exists(
     os.path.join(BASE_DIR, "private.pem")
 )
 
+# Maximum number of tracks searched for at once per conversion, by
+# destination service
+MATCHING_CONCURRENCY = {
+    "spotify": int(get_secret("SPOTIFY_MATCHING_CONCURRENCY", 8)),
+    "apple-music": int(get_secret("APPLE_MUSIC_MATCHING_CONCURRENCY", 4)),
+}
+
+# Playlists longer than this are matched in chunks of this many tracks by
+# separate subtasks
+CONVERSION_CHUNK_SIZE = int(get_secret("CONVERSION_CHUNK_SIZE", 250))
+
+# How long, in seconds, fetched source playlists are kept for later
+# conversions of the same playlist. A kept copy is only used while the
+# service reports the playlist unchanged.
+PLAYLIST_CACHE_TIMEOUT = int(get_secret("PLAYLIST_CACHE_TIMEOUT", 3600 * 24))
+
+# How long search results are cached for, in seconds, by search strategy
+SEARCH_CACHE_TIMEOUTS = {
+    "isrc": int(get_secret("ISRC_SEARCH_CACHE_TIMEOUT", 3600 * 24 * 15)),
+    "full_metadata": int(
+        get_secret("FULL_METADATA_SEARCH_CACHE_TIMEOUT", 3600 * 24 * 3)
+    ),
+    "primary_artist": int(
+        get_secret("PRIMARY_ARTIST_SEARCH_CACHE_TIMEOUT", 3600 * 24 * 3)
+    ),
+    "fuzzy_name": int(get_secret("FUZZY_NAME_SEARCH_CACHE_TIMEOUT", 3600 * 24)),
+}
+
+# Most requests per second sent to each upstream API by all workers together,
+# per kind of endpoint. The actual rate adapts below this to 429 responses.
+UPSTREAM_RATE_LIMITS = {
+    "spotify": float(get_secret("SPOTIFY_RATE_LIMIT", 20)),
+    "apple-music": float(get_secret("APPLE_MUSIC_RATE_LIMIT", 20)),
+}
+
+# Catalog responses of upstream APIs can be cached in Redis, by upstream and
+# kind of endpoint. A response is used without asking the API again for its
+# timeout, in seconds, then revalidated if the API gave it an ETag or
+# Last-Modified. Playlists change, so by default they are only revalidated.
+RESPONSE_CACHE_ENABLED = bool(int(get_secret("RESPONSE_CACHE_ENABLED", 0)))
+RESPONSE_CACHE_TIMEOUTS = {
+    "apple-music": {
+        "search": int(get_secret("APPLE_MUSIC_SEARCH_RESPONSE_TIMEOUT", 3600 * 24)),
+        "songs": int(get_secret("APPLE_MUSIC_SONGS_RESPONSE_TIMEOUT", 3600 * 24 * 7)),
+        "playlists": int(get_secret("APPLE_MUSIC_PLAYLISTS_RESPONSE_TIMEOUT", 0)),
+    },
+}
+
+# How long, in seconds, a track that could not be matched is skipped for
+MISSED_TRACK_CACHE_TIMEOUT = int(get_secret("MISSED_TRACK_CACHE_TIMEOUT", 3600 * 6))
+
+# Conversions are routed to a queue by playlist size, so that short playlists
+# do not wait behind long ones. Each queue is consumed by its own worker.
+SMALL_PLAYLIST_MAX_TRACKS = int(get_secret("SMALL_PLAYLIST_MAX_TRACKS", 100))
+LARGE_PLAYLIST_MIN_TRACKS = int(get_secret("LARGE_PLAYLIST_MIN_TRACKS", 1000))
+WORKER_CONCURRENCY = {
+    "small": int(get_secret("SMALL_QUEUE_CONCURRENCY", 50)),
+    "medium": int(get_secret("MEDIUM_QUEUE_CONCURRENCY", 20)),
+    "large": int(get_secret("LARGE_QUEUE_CONCURRENCY", 5)),
+}
+
+# Connections kept alive to Apple Music per worker process. Matches the
+# largest worker concurrency, so concurrent greenlets each get a pooled one.
+APPLE_MUSIC_POOL_SIZE = int(
+    get_secret("APPLE_MUSIC_POOL_SIZE", max(WORKER_CONCURRENCY.values()))
+)
+
+# How long, in seconds, the size of a converted playlist is remembered for
+# routing later conversions of it
+PLAYLIST_SIZE_CACHE_TIMEOUT = int(
+    get_secret("PLAYLIST_SIZE_CACHE_TIMEOUT", 3600 * 24 * 30)
+)
+
 CELERY_BROKER_URL = get_secret("REDIS_URL")
 
+# Used for anything not routed by size, e.g. when the size is unknown
+CELERY_TASK_DEFAULT_QUEUE = "medium"
+
 CELERY_RESULT_BACKEND = get_secret("REDIS_URL")
 
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
@@ -7,6 +7,7 @@ urlpatterns = [
     path("robots.txt", views.robots_txt, name="robots-txt"),
     path("sitemap.xml", views.sitemap_xml, name="sitemap-xml"),
     path("celery-progress/", include("celery_progress.urls"), name="celery-progress"),
+    path("events/<str:task_id>", views.conversion_events, name="conversion-events"),
     path("login", views.login, name="login"),
     path("expand", views.expand, name="expand"),
     path("playlist", views.playlist, name="playlist"),